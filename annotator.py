@@ -1,34 +1,118 @@
+import __builtin__
+import weakref
+import discovery
+import profiling
+
 # Annotator needs to find the least generic type for everything. 
 # To do that, it needs to hold a model of our types.
+# Annotations are interned, so they're compared by identity.
+# Annotations only ever widen, so we keep def-use chains and reschedule
+# just the users of a value when its annotation changes. The fixpoint
+# then costs time proportional to the changes. 'iterations' counts the
+# values annotated, and 'requeues' the ones scheduled again by a change.
 class Annotator(object):
     def __init__(self, unit):
         self.unit = unit
         self.stack = []
+        self.queued = set()
+        self.users = {}
+        self.iterations = 0
+        self.requeues = 0
+
+    # Globals aren't among the values of the procedure, they're reset
+    # here so that a changed global gets looked up again.
+    def update(self, proc):
+        for value in proc.values():
+            self.users[value] = set()
+        for value in proc.values():
+            for arg in operands(value):
+                if isinstance(arg, discovery.Global) and arg not in self.users:
+                    self.users[arg] = set()
+                    arg.annotation = None
+                    self.schedule(arg)
+                self.users[arg].add(value)
+            self.schedule(value)
+
+    # Forgets a procedure that is replaced, so that its values are no
+    # longer kept alive or annotated.
+    def remove(self, proc):
+        removed = set()
+        for value in proc.values():
+            removed.add(value)
+            removed.update(arg for arg in operands(value)
+                if isinstance(arg, discovery.Global))
+        for value in removed:
+            self.users.pop(value, None)
+        self.queued -= removed
+        self.stack = [value for value in self.stack if value not in removed]
 
-    def update(self, func):
-        for block in func:
-            for op in block.ops:
-                if not op.queued:
-                    self.stack.append(op)
-                    op.queued = True
+    def schedule(self, value):
+        if value not in self.queued:
+            self.stack.append(value)
+            self.queued.add(value)
 
     def run(self):
-        while len(self.stack) > 0:
-            op = self.stack.pop()
-            op.queued = False
-            if op.name == 'call':
-                print 'annotate', op
-            elif op.name == 'return':
-                a = union(op.block.func.annotation.restype, op.args[0].annotation)
-                op.args[0].annotation = a
-                op.block.func.annotation.restype = a
-                op.annotation = a
-                print 'return update', op, a
-                # bit incorrect, should push uses of argument in too.
-            else:
-                assert False
-            # Should annotate here, if some of the fields change,
-            # should reschedule the used fields.
+        iterations, requeues = self.iterations, self.requeues
+        with profiling.phase('annotate'):
+            while len(self.stack) > 0:
+                value = self.stack.pop()
+                self.queued.discard(value)
+                self.iterations += 1
+                annotation = self.annotate(value)
+                if annotation is not value.annotation:
+                    value.annotation = annotation
+                    for user in self.users.get(value, ()):
+                        if user not in self.queued:
+                            self.requeues += 1
+                            self.schedule(user)
+        profiling.count('annotator iterations', self.iterations - iterations)
+        profiling.count('annotator requeues', self.requeues - requeues)
+
+    def annotate(self, value):
+        if isinstance(value, discovery.Argument):
+            return value.proc.annotation[value.index]
+        if isinstance(value, discovery.Global):
+            return annotate_global(value)
+        if isinstance(value, discovery.Phi):
+            annotation = value.annotation
+            for arg in value.args.values():
+                annotation = union(annotation, arg.annotation)
+            return annotation
+        if value.name == 'const':
+            return annotate_constant(value.args[0])
+        if value.name == 'return':
+            proc = value.block.proc
+            a = union(proc.annotation.restype, value.args[0].annotation)
+            if a is not proc.annotation.restype:
+                proc.annotation = FuncType(a, proc.annotation.argtypes)
+            return a
+        if value.name in ('jump', 'cond', 'fallthrough'):
+            return None
+        raise Exception("cannot annotate {}".format(value))
+
+# The values an instruction or phi-node reads.
+def operands(value):
+    if isinstance(value, discovery.Phi):
+        return value.args.values()
+    if isinstance(value, discovery.Instruction):
+        return [arg for arg in value.args if isinstance(arg, (
+            discovery.Argument, discovery.Instruction, discovery.Phi, discovery.Global))]
+    return []
+
+def annotate_global(value):
+    func_globals = value.block.proc.func.func_globals
+    if value.name in func_globals:
+        return annotate_constant(func_globals[value.name])
+    return annotate_constant(getattr(__builtin__, value.name, None))
+
+def annotate_constant(value):
+    if isinstance(value, bool):
+        return Constant(t_bool, value)
+    if isinstance(value, (int, long)):
+        return Constant(t_int, value)
+    if isinstance(value, float):
+        return Constant(t_float, value)
+    return anything
 
 # SPIR-V annotation may need much simpler rules than specified here.
 
@@ -41,19 +125,43 @@ class Anything(object):
     def __repr__(self):
         return 'anything'
 
+# Types are treated as notation. Equal types are the same object, the
+# constructors return the existing instance if there is one. The
+# instances are held weakly, so the constants and function types of
+# translations that are gone don't pile up.
+def interned(cls, key, *fields):
+    try:
+        return cls.instances[key]
+    except KeyError:
+        self = object.__new__(cls)
+        for name, value in zip(cls.fields, fields):
+            setattr(self, name, value)
+        cls.instances[key] = self
+        return self
+
 # The next most specific type after 'Unbound'.
+# The class of the value is in the key, as 1 == 1.0 == True. Floats
+# are keyed by their repr, as 0.0 == -0.0, and nan != nan.
 class Constant(object):
-    def __init__(self, type, value):
-        self.type = type
-        self.value = value
+    instances = weakref.WeakValueDictionary()
+    fields = ['type', 'value']
+
+    def __new__(cls, type, value):
+        key = repr(value) if isinstance(value, float) else value
+        return interned(cls, (type, value.__class__, key), type, value)
 
     def __repr__(self):
         return 'Constant({}, {})'.format(self.type, self.value)
 
+# FuncTypes are never modified, a procedure with a wider result type
+# gets a new FuncType.
 class FuncType(object):
-    def __init__(self, restype, argtypes):
-        self.restype = restype
-        self.argtypes = argtypes
+    instances = weakref.WeakValueDictionary()
+    fields = ['restype', 'argtypes']
+
+    def __new__(cls, restype, argtypes):
+        argtypes = tuple(argtypes)
+        return interned(cls, (restype, argtypes), restype, argtypes)
 
     def __getitem__(self, index):
         return self.argtypes[index]
@@ -62,31 +170,33 @@ class FuncType(object):
         return len(self.argtypes)
 
     def __repr__(self):
-        return '({}) ->'.format(', '.join(map(repr, self.argtypes)), self.restype)
+        return '({}) -> {}'.format(', '.join(map(repr, self.argtypes)), self.restype)
 
 class Type(object):
+    instances = weakref.WeakValueDictionary()
+    fields = ['name', 'generic', 'parametric', 'specificity']
+
     def __call__(self, parameter):
         assert self.parametric
         return Parametric(self, parameter)
 
-    def __init__(self, name, generic, parametric=False):
-        self.name = name
-        self.generic = generic
-        self.parametric = parametric
-        self.specificity = generic.specificity+1
+    def __new__(cls, name, generic, parametric=False):
+        return interned(cls, (name, generic, parametric),
+            name, generic, parametric, generic.specificity+1)
 
     def __repr__(self):
         return self.name
 
 class Parametric(object):
-    def __init__(self, func, parameter):
-        self.func = func
-        self.parameter = parameter
+    instances = weakref.WeakValueDictionary()
+    fields = ['func', 'parameter']
+
+    def __new__(cls, func, parameter):
+        return interned(cls, (func, parameter), func, parameter)
 
     def __repr__(self):
         return "{}({})".format(self.func, self.parameter)
 
-# Types are treated as notation. They should be uniquely identified.
 anything = Anything()
 
 # not sure whether these belong here.
@@ -108,11 +218,23 @@ t_vec4 = Type('vec4', anything, parametric=True)
 
 # I don't want parametric types to leak from
 # their parametric container.
+# The types are interned, so the results can be memoized by identity.
+# The memo holds on to its types, so it's emptied when it gets large.
 def union(a, b):
-    c = union_raw(a, b)
-    while isinstance(c, Type) and c.parametric:
-        c = c.generic
-    return c
+    if a is b:
+        return a
+    try:
+        return union_cache[a, b]
+    except KeyError:
+        c = union_raw(a, b)
+        while isinstance(c, Type) and c.parametric:
+            c = c.generic
+        if len(union_cache) >= union_cache_size:
+            union_cache.clear()
+        union_cache[a, b] = c
+        return c
+union_cache = {}
+union_cache_size = 1 << 16
 # But we still may use unification results which
 # return parametric types.
 def union_raw(a, b):
@@ -123,10 +245,7 @@ def union_raw(a, b):
     if b is None:
         return a
     if isinstance(a, Constant) and isinstance(b, Constant):
-        if a.value == b.value:
-            return a
-        else:
-            return union_raw(a.type, b.type)
+        return union_raw(a.type, b.type) # Equal constants are the same object.
     elif isinstance(a, Constant):
         return union_raw(a.type, b)
     elif isinstance(b, Constant):
@@ -0,0 +1,291 @@
+import argparse
+import re
+import sys
+from spirv import *
+
+# The text form of modules, one instruction per line:
+#
+#     %main = OpFunction %void DontInline %3
+#
+# Results are written before the '=', the type id comes first after the
+# opname, and the operands follow in the order of spirv.json. Strings
+# are quoted, masks are joined with '|', and the words of unknown
+# instructions are written after 'OpUnknown' and the opcode.
+#
+# Both directions stream. The disassembler decodes one instruction at a
+# time from the words, and the assembler encodes one line at a time
+# through spirv.Writer, so only the id names are kept in memory.
+
+# Writes the module in text, into the file. With names, the ids get
+# their names from OpName, so the first name given to an id, and the
+# first id given a name, wins. The other ids keep their numbers.
+def disassemble(data, fd, names=True):
+    data, info = decode_header(data)
+    fd.write('; SPIR-V\n; Version: {}\n; Generator: {}\n; Bound: {}\n; Schema: {}\n'.format(
+        version, info['generator_id'], info['bound'], data[4]))
+    labels = collect_names(data) if names else {}
+    ids = FreshIds()
+    lines = []
+    for start, stop in instruction_ranges(data):
+        instruction = decode_instruction(data[start] & 0xFFFF, data[start+1:stop], ids)
+        lines.append(format_instruction(instruction, labels))
+        if len(lines) >= 1024:
+            fd.write('\n'.join(lines) + '\n')
+            del lines[:]
+    if len(lines) > 0:
+        fd.write('\n'.join(lines) + '\n')
+
+# Decoded instructions refer to fresh Id objects, so nothing is kept
+# for the ids the module has already gone past.
+class FreshIds(object):
+    def __getitem__(self, result_id):
+        return Id(result_id)
+
+def instruction_ranges(data):
+    start = 5
+    end = len(data)
+    while start < end:
+        length = data[start] >> 16
+        assert length != 0
+        assert start + length <= end, "last instruction is truncated"
+        yield start, start + length
+        start += length
+
+# Only the OpNames are decoded when looking for the names.
+def collect_names(data):
+    opcode = opname_table['OpName']['opcode']
+    labels = {}
+    taken = set()
+    ids = FreshIds()
+    for start, stop in instruction_ranges(data):
+        if data[start] & 0xFFFF != opcode:
+            continue
+        instruction = decode_instruction(opcode, data[start+1:stop], ids)
+        if isinstance(instruction, UnknownInstruction):
+            continue
+        result_id = instruction.args[0].result_id
+        label = sanitize(instruction.args[1])
+        if result_id not in labels and label not in taken:
+            labels[result_id] = label
+            taken.add(label)
+    return labels
+
+# Names that could be mistaken for numbers get an underscore in front.
+def sanitize(name):
+    label = re.sub(r'[^A-Za-z0-9_.]', '_', name.encode('utf-8'))
+    if label == '' or label[0].isdigit():
+        label = '_' + label
+    return label
+
+def format_instruction(instruction, labels):
+    if isinstance(instruction, UnknownInstruction):
+        return ' '.join(['OpUnknown', str(instruction.opcode)] + map(str, instruction.data))
+    fmt = opname_table[instruction.name]
+    words = [str(instruction.name)]
+    if fmt['type']:
+        words.append(format_id(instruction.type_id, labels))
+    for operand, arg in zip(fmt['operands'], instruction.args):
+        format_operand(operand, arg, labels, words)
+    if fmt['result']:
+        words[0:0] = [format_id(instruction.result_id, labels), '=']
+    return ' '.join(words)
+
+def format_id(result_id, labels):
+    if result_id in labels:
+        return '%' + labels[result_id]
+    return '%' + str(result_id)
+
+def format_operand(operand, arg, labels, words):
+    if operand == 'Id':
+        words.append(format_id(arg.result_id, labels))
+    elif operand == 'LiteralNumber':
+        words.append(str(arg))
+    elif operand == 'LiteralString':
+        words.append(quote(arg))
+    elif operand == 'VariableLiterals':
+        words.extend(map(str, arg))
+    elif operand == 'VariableIds':
+        words.extend(format_id(item.result_id, labels) for item in arg)
+    elif operand == 'VariableLiteralId':
+        for literal, item in arg:
+            words.append(str(literal))
+            words.append(format_id(item.result_id, labels))
+    elif operand == 'OptionalId':
+        if arg is not None:
+            words.append(format_id(arg.result_id, labels))
+    elif operand in bitmask_table:
+        words.append('|'.join(sorted(map(str, arg))) if len(arg) > 0 else 'None')
+    else:
+        words.append(str(arg))
+
+# Control characters are escaped like in C, so every string stays on
+# its line.
+def quote(string):
+    return '"' + re.sub(r'[\\"\x00-\x1f\x7f]', escape, string.encode('utf-8')) + '"'
+
+def escape(match):
+    char = match.group(0)
+    if char in escapes:
+        return escapes[char]
+    return '\\x{:02x}'.format(ord(char))
+
+def unquote(token):
+    return re.sub(r'\\(x[0-9a-fA-F]{2}|.)', unescape, token[1:-1]).decode('utf-8')
+
+def unescape(match):
+    sequence = match.group(1)
+    if sequence.startswith('x') and len(sequence) == 3:
+        return chr(int(sequence[1:], 16))
+    return unescapes.get(sequence, sequence)
+
+escapes = {'\\':'\\\\', '"':'\\"', '\n':'\\n', '\r':'\\r', '\t':'\\t'}
+unescapes = {'n':'\n', 'r':'\r', 't':'\t'}
+
+# Reads the text from an iterable of lines, such as a file, and writes
+# the module into fd. Numbered ids keep their numbers, and the named ids
+# are numbered from the bound in the header comments, or from 1 if there
+# isn't one, skipping the numbers already used. A number used after the
+# name that got it is an error. Returns the bound of the written module.
+def assemble(lines, fd):
+    assembler = Assembler(fd)
+    for lineno, line in enumerate(lines, 1):
+        try:
+            assembler.feed(line)
+        except Exception as error:
+            raise Exception("line {}: {}".format(lineno, error))
+    return assembler.close()
+
+token_pattern = re.compile(r'"(?:[^"\\]|\\.)*"|[^\s"]+')
+header_pattern = re.compile(r';\s*(Generator|Bound|Schema):\s*(\d+)')
+
+class Assembler(object):
+    def __init__(self, fd):
+        self.fd = fd
+        self.header = {'Generator':0, 'Bound':1, 'Schema':0}
+        self.writer = None
+        self.names = {}    # name -> id
+        self.numbers = set() # ids given to names
+        self.used = set()    # ids written as numbers
+        self.next_id = None
+
+    def feed(self, line):
+        tokens = token_pattern.findall(line)
+        for index, token in enumerate(tokens):
+            if token.startswith(';'):
+                del tokens[index:]
+                break
+        if len(tokens) == 0:
+            match = header_pattern.match(line.strip())
+            if match and self.writer is None:
+                self.header[match.group(1)] = int(match.group(2))
+            return
+        if self.writer is None:
+            self.writer = Writer(self.fd, None, self.header['Generator'], self.header['Schema'])
+            self.next_id = self.header['Bound']
+        if tokens[0] == 'OpUnknown':
+            data = map(int, tokens[1:])
+            self.writer.write_words([len(data) << 16 | data[0]] + data[1:])
+            return
+        self.writer.write(self.parse(tokens))
+
+    def parse(self, tokens):
+        result_id = 0
+        if len(tokens) > 1 and tokens[1] == '=':
+            result_id = self.id(tokens[0])
+            tokens = tokens[2:]
+        name = tokens[0]
+        if name not in opname_table:
+            raise Exception("unknown instruction {}".format(name))
+        fmt = opname_table[name]
+        if fmt['result'] != (result_id != 0):
+            raise Exception("{} {} a result".format(name,
+                'needs' if fmt['result'] else 'does not have'))
+        rest = iter(tokens[1:])
+        type_id = self.id(next(rest)) if fmt['type'] else 0
+        args = [self.parse_operand(operand, rest) for operand in fmt['operands']]
+        if next(rest, None) is not None:
+            raise Exception("too many operands for {}".format(name))
+        return Instruction(name, type_id, result_id, args)
+
+    def parse_operand(self, operand, rest):
+        if operand == 'Id':
+            return Id(self.id(next(rest)))
+        if operand == 'LiteralNumber':
+            return int(next(rest), 0)
+        if operand == 'LiteralString':
+            token = next(rest)
+            if not token.startswith('"'):
+                raise Exception("expected a string, got {}".format(token))
+            return unquote(token)
+        if operand == 'VariableLiterals':
+            return [int(token, 0) for token in rest]
+        if operand == 'VariableIds':
+            return [Id(self.id(token)) for token in rest]
+        if operand == 'VariableLiteralId':
+            tokens = list(rest)
+            if len(tokens) % 2 != 0:
+                raise Exception("literals and ids do not pair up")
+            return [(int(tokens[k], 0), Id(self.id(tokens[k+1])))
+                for k in range(0, len(tokens), 2)]
+        if operand == 'OptionalId':
+            token = next(rest, None)
+            return None if token is None else Id(self.id(token))
+        if operand in bitmask_table:
+            mask = set()
+            for name in next(rest).split('|'):
+                if name.isdigit():
+                    mask.add(int(name))
+                elif name not in bitmask_table[operand]:
+                    raise Exception("{} is not in {}".format(name, operand))
+                elif bitmask_table[operand][name] != 0:
+                    mask.add(name)
+            return mask
+        token = next(rest)
+        if token not in const_name_table[operand]:
+            raise Exception("{} is not in {}".format(token, operand))
+        return token
+
+    def id(self, token):
+        if not token.startswith('%'):
+            raise Exception("expected an id, got {}".format(token))
+        name = token[1:]
+        if name.isdigit():
+            result_id = int(name)
+            if result_id in self.numbers:
+                raise Exception("{} is taken by a named id, the bound in the header is too small".format(token))
+            self.used.add(result_id)
+            return result_id
+        if name not in self.names:
+            while self.next_id in self.used:
+                self.next_id += 1
+            self.names[name] = self.next_id
+            self.numbers.add(self.next_id)
+            self.next_id += 1
+        return self.names[name]
+
+    def close(self):
+        if self.writer is None:
+            self.writer = Writer(self.fd, None, self.header['Generator'], self.header['Schema'])
+            self.next_id = self.header['Bound']
+        # The bound covers the named ids and the one in the header.
+        self.writer.max_id = max(self.writer.max_id, self.next_id - 1)
+        return self.writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert SPIR-V files to text and back.")
+    parser.add_argument('mode', choices=['dis', 'as'])
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--numbers', action='store_true',
+        help="write every id as a number, so the text assembles into the same words")
+    args = parser.parse_args()
+    if args.mode == 'dis':
+        with open(args.input, 'rb') as fd, open(args.output, 'w') as output:
+            disassemble(map_words(fd), output, not args.numbers)
+    else:
+        with open(args.input) as fd, open(args.output, 'wb') as output:
+            assemble(fd, output)
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -0,0 +1,292 @@
+from array import array
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import discovery
+import reflection
+import spirv
+import verify
+
+# Benchmarks for the things we want to keep fast. Each case runs in a
+# fresh process, so that the peak memory reported for it isn't polluted
+# by the cases that ran before it. Results can be saved and compared
+# against an earlier run to catch regressions.
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for spirthon.")
+    parser.add_argument('samples', nargs='*',
+        help="real SPIR-V files or directories to benchmark along the synthetic ones")
+    parser.add_argument('-n', '--size', type=int, default=100000,
+        help="number of instructions in the synthetic module")
+    parser.add_argument('--mix', default=None,
+        help="opcode mix of the synthetic module, such as OpIAdd=4,OpName=1")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--blocks', type=int, default=5000,
+        help="number of blocks in the synthetic flow graphs")
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-k', '--select', default='',
+        help="run only the cases whose name contains this")
+    parser.add_argument('--save', metavar='FILE', help="save the results as json")
+    parser.add_argument('--compare', metavar='FILE', help="compare against saved results")
+    options = parser.parse_args()
+    if len(options.samples) == 0:
+        options.samples = [spirv.basepath or '.']
+    options.samples = verify.find_files(options.samples)
+    # The synthetic module is generated once, the cases read it from a file.
+    fd, options.synthetic = tempfile.mkstemp(suffix='.spv')
+    try:
+        instructions, bound = synthetic_module(options.size, parse_mix(options.mix), options.seed)
+        os.write(fd, spirv.stringify_spirv(spirv.encode_spirv(instructions, bound)))
+        os.close(fd)
+        del instructions
+        results = {}
+        for name in case_names(options):
+            if options.select not in name:
+                continue
+            pool = multiprocessing.Pool(1, maxtasksperchild=1)
+            try:
+                results[name] = result = pool.apply(run_case, (name, options))
+            finally:
+                pool.terminate()
+            report(name, result)
+    finally:
+        os.remove(options.synthetic)
+    if options.compare:
+        with open(options.compare) as fd:
+            compare(json.load(fd)['results'], results)
+    if options.save:
+        with open(options.save, 'w') as fd:
+            json.dump({'python':sys.version, 'date':time.time(),
+                'size':options.size, 'mix':options.mix, 'seed':options.seed,
+                'results':results}, fd, indent=2, sort_keys=True)
+
+# The suites give the cases in order, every suite is a function that
+# returns a list of (name, setup) pairs. setup() prepares the input and
+# returns a function to time and the amount of items and bytes it handles.
+suites = []
+
+def suite(function):
+    suites.append(function)
+    return function
+
+def case_names(options):
+    return [name for function in suites for name, setup in function(options)]
+
+def run_case(name, options):
+    for function in suites:
+        for name_, setup in function(options):
+            if name_ == name:
+                return measure(setup, options.repeat)
+    raise Exception("no such case: {}".format(name))
+
+def measure(setup, repeat):
+    run, items, size = setup()
+    gc.collect()
+    base = peak_rss()
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.time()
+        run()
+        best = min(best, time.time() - start)
+    best = max(best, 1e-9)
+    return {'time':best, 'items':items, 'bytes':size,
+        'items_per_s':items / best, 'mb_per_s':size / best / 1e6,
+        'peak_kb':max(0, peak_rss() - base)}
+
+# ru_maxrss is in kilobytes on linux, but in bytes on OS X.
+def peak_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+def report(name, result):
+    print "{:40} {:9.4f}s {:12.0f} items/s {:8.2f} MB/s {:8} KB peak".format(
+        name, result['time'], result['items_per_s'], result['mb_per_s'], result['peak_kb'])
+    sys.stdout.flush()
+
+def compare(old, new):
+    print
+    print "{:40} {:>10} {:>10} {:>8}".format('compared to saved', 'before', 'after', 'change')
+    for name in sorted(new):
+        if name in old:
+            before = old[name]['time']
+            after = new[name]['time']
+            print "{:40} {:9.4f}s {:9.4f}s {:+7.1f}%".format(
+                name, before, after, (after - before) / before * 100)
+
+# Synthetic modules only need to be decodable, they don't need to make
+# any sense. The default mix resembles the instructions in a shader.
+default_mix = {
+    'OpName':2, 'OpDecorate':2, 'OpTypeInt':1, 'OpTypeVector':1,
+    'OpConstant':3, 'OpVariable':2, 'OpLabel':2, 'OpLoad':8, 'OpStore':6,
+    'OpAccessChain':4, 'OpIAdd':6, 'OpFMul':6, 'OpFAdd':6,
+    'OpCompositeConstruct':3, 'OpVectorShuffle':2, 'OpCompositeExtract':3,
+    'OpBranch':2, 'OpBranchConditional':1, 'OpFunctionCall':1,
+}
+
+def parse_mix(text):
+    if text is None:
+        return default_mix
+    if text == 'all':
+        return dict((name, 1) for name in spirv.opname_table)
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name not in spirv.opname_table:
+            raise Exception("unknown opname in mix: {}".format(name))
+        mix[name] = int(weight or 1)
+    return mix
+
+def synthetic_module(size, mix=None, seed=0):
+    rng = random.Random(seed)
+    mix = default_mix if mix is None else mix
+    names = sorted(mix)
+    weights = [mix[name] for name in names]
+    total = float(sum(weights))
+    instructions = []
+    next_id = 2
+    for _ in xrange(size):
+        point = rng.random() * total
+        for name, weight in zip(names, weights):
+            point -= weight
+            if point < 0:
+                break
+        fmt = spirv.opname_table[name]
+        instruction = synthetic_instruction(fmt, rng, next_id)
+        next_id = max(next_id, instruction.result_id + 1)
+        instructions.append(instruction)
+    return instructions, next_id
+
+def synthetic_instruction(fmt, rng, next_id):
+    some_id = lambda: spirv.Id(rng.randrange(1, next_id))
+    type_id = rng.randrange(1, next_id) if fmt['type'] else 0
+    result_id = next_id if fmt['result'] else 0
+    args = []
+    for operand in fmt['operands']:
+        count = rng.randrange(0, 5)
+        if operand in spirv.bitmask_table:
+            masks = [name for name, value in spirv.bitmask_table[operand].items() if value]
+            args.append(set([rng.choice(sorted(masks))]))
+        elif operand in spirv.const_table:
+            args.append(rng.choice(sorted(spirv.const_table[operand].values())))
+        elif operand == 'LiteralNumber':
+            args.append(rng.randrange(0, 1 << 16))
+        elif operand == 'LiteralString':
+            args.append(u''.join(rng.choice('abcdefghijklmnopqrstuvwxyz_')
+                for _ in range(rng.randrange(1, 24))))
+        elif operand == 'Id':
+            args.append(some_id())
+        elif operand == 'VariableLiteralId':
+            args.append([(rng.randrange(0, 256), some_id()) for _ in range(count)])
+        elif operand == 'VariableLiterals':
+            args.append([rng.randrange(0, 1 << 16) for _ in range(count)])
+        elif operand == 'VariableIds':
+            args.append([some_id() for _ in range(count)])
+        elif operand == 'OptionalId':
+            args.append(some_id() if count > 2 else None)
+    return spirv.Instruction(fmt['name'], type_id, result_id, args)
+
+# Codec benchmarks over the synthetic module and the sample files.
+# The setup must not allocate more than the timed operation does, or
+# the peak memory of the setup hides the peak of the operation.
+@suite
+def codec_suite(options):
+    inputs = [('synthetic', lambda: read_words(options.synthetic))]
+    for path in options.samples:
+        inputs.append((os.path.basename(path), lambda path=path: read_words(path)))
+    cases = []
+    for label, load in inputs:
+        for operation in ['decode', 'decode_lazy', 'decode_packed',
+                'encode', 'roundtrip', 'reflect']:
+            cases.append(('{} {}'.format(operation, label),
+                lambda operation=operation, load=load: codec_case(operation, load())))
+    cases.append(('decode_literal_string', lambda: string_case(options, 'decode')))
+    cases.append(('encode_literal_string', lambda: string_case(options, 'encode')))
+    return cases
+
+def read_words(path):
+    with open(path, 'rb') as fd:
+        return array('I', fd.read())
+
+def codec_case(operation, words):
+    module, info = spirv.decode_spirv_lazy(words)
+    count = len(module)
+    size = len(words) * 4
+    if operation == 'encode':
+        instructions, info = spirv.decode_spirv(words)
+    if operation == 'decode':
+        return (lambda: spirv.decode_spirv(words)), count, size
+    if operation == 'decode_lazy':
+        return (lambda: spirv.decode_spirv_lazy(words)), count, size
+    if operation == 'decode_packed':
+        return (lambda: spirv.decode_spirv_packed(words)), count, size
+    if operation == 'encode':
+        return (lambda: spirv.encode_spirv(instructions, **info)), count, size
+    if operation == 'roundtrip':
+        return (lambda: spirv.decode_spirv(spirv.encode_spirv(
+            spirv.decode_spirv(words)[0], **info))), count, size
+    if operation == 'reflect':
+        return (lambda: reflection.reflect(words)), count, size
+    raise Exception("no such operation: {}".format(operation))
+
+def string_case(options, operation):
+    rng = random.Random(options.seed)
+    strings = [u''.join(rng.choice(u'abcdefghijklmnopqrstuvwxyz_\xe4')
+        for _ in range(rng.randrange(1, 64))) for _ in xrange(options.size)]
+    encoded = [list(spirv.encode_literal_string(string)) for string in strings]
+    size = sum(len(words) * 4 for words in encoded)
+    if operation == 'decode':
+        def run():
+            for words in encoded:
+                spirv.decode_literal_string(iter(words))
+    else:
+        def run():
+            for string in strings:
+                list(spirv.encode_literal_string(string))
+    return run, len(strings), size
+
+# Dominator trees over synthetic flow graphs. The 'nested' graph is a
+# sequence of loops nested 32 deep.
+@suite
+def discovery_suite(options):
+    cases = []
+    for shape in ['branchy', 'nested']:
+        cases.append(('dominators {} {}'.format(shape, options.blocks),
+            lambda shape=shape: dominator_case(options, shape)))
+    return cases
+
+def dominator_case(options, shape):
+    proc = synthetic_flow(options.blocks, shape, options.seed)
+    edges = sum(len(block.succ) for block in proc.blocks)
+    return (lambda: discovery.DominatorTree(proc.blocks[0])), len(proc.blocks), edges
+
+# Every block jumps or branches forward, and some of them loop back.
+# The entry block is never the target of a jump. Instruction links the
+# blocks together.
+def synthetic_flow(size, shape, seed):
+    rng = random.Random(seed)
+    proc = discovery.Procedure(None)
+    blocks = [proc.new_block() for _ in xrange(size)]
+    for i, block in enumerate(blocks[:-1]):
+        targets = [blocks[i+1]]
+        if shape == 'nested' and i % 64 >= 32:
+            targets.append(blocks[i - i % 64 + 63 - i % 64])
+        elif shape == 'branchy' and rng.random() < 0.5:
+            if i > 0 and rng.random() < 0.2:
+                targets.append(blocks[rng.randrange(1, i+1)])
+            else:
+                targets.append(blocks[rng.randrange(i+1, min(size, i+20))])
+        if len(targets) == 1:
+            discovery.Instruction(block, 0, 'jump', targets)
+        else:
+            discovery.Instruction(block, 0, 'cond', [None] + targets)
+    discovery.Instruction(blocks[-1], 0, 'return', [None])
+    return proc
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,109 @@
+import errno
+import os
+import tempfile
+import time
+try:
+    import fcntl
+except ImportError: # Eviction goes without a lock on platforms without fcntl.
+    fcntl = None
+
+# Content addressed cache on the disk. Entries are files named by their
+# key, and are written under a temporary name and renamed into place, so
+# several processes may share the same cache directory. Reading an entry
+# touches it, and when the cache grows past max_size the least recently
+# used entries are removed.
+class DiskCache(object):
+    def __init__(self, path=None, max_size=64 << 20):
+        if path is None:
+            path = default_path()
+        self.path = path
+        self.max_size = max_size
+        self.written = 0 # Bytes written since the last eviction.
+        self.hits = 0
+        self.misses = 0
+        makedirs(path)
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+        except IOError as error:
+            if error.errno != errno.ENOENT:
+                raise
+            self.misses += 1
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass # It may have been evicted already.
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = self.entry_path(key)
+        makedirs(os.path.dirname(path))
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fd:
+                fd.write(data)
+            os.rename(temp_path, path)
+        except:
+            remove(temp_path)
+            raise
+        self.written += len(data)
+        if self.written > self.max_size // 16:
+            self.evict()
+
+    # Only one process evicts at a time, the others skip it.
+    def evict(self):
+        self.written = 0
+        with open(os.path.join(self.path, 'lock'), 'a') as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    return
+            entries = []
+            total = 0
+            now = time.time()
+            for root, dirs, files in os.walk(self.path):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    if name.startswith('.tmp'): # Left behind by a crashed writer.
+                        if stat.st_mtime < now - 3600:
+                            remove(path)
+                        continue
+                    if root != self.path:
+                        entries.append((stat.st_mtime, stat.st_size, path))
+                        total += stat.st_size
+            entries.sort()
+            for mtime, size, path in entries:
+                if total <= self.max_size:
+                    break
+                remove(path)
+                total -= size
+
+def default_path():
+    return os.environ.get('SPIRTHON_CACHE',
+        os.path.join(os.path.expanduser('~'), '.cache', 'spirthon'))
+
+def makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -1,13 +1,19 @@
+from array import array
+from bisect import bisect_right
 from collections import namedtuple
-from dis import findlabels
+from dis import findlinestarts
+import gc
 import itertools
+import marshal
 import opcode
+import profiling
 
 # Discovery -stage converts functions into SSA -form.
 class Procedure(object):
     def __init__(self, func):
         self.blocks = []
         self.func = func
+        self.arguments = []
         self.counter = itertools.count(1) # helps at finding out errors from this code.
 
     def __str__(self):
@@ -20,7 +26,36 @@ class Procedure(object):
         self.blocks.append(block)
         return block
 
+    # Everything in the procedure that gets annotated.
+    def values(self):
+        for argument in self.arguments:
+            yield argument
+        for block in self.blocks:
+            for phi in block.phi.values():
+                yield phi
+            for instruction in block.instructions:
+                yield instruction
+
+    # Pickling the graph of blocks would recurse as deep as the paths
+    # through it go, so the procedure is pickled as flat tables instead.
+    # The function doesn't go along, the receiver has to set it back.
+    def __getstate__(self):
+        return pack(self)
+
+    # Unpacking only allocates, and the collector would walk through
+    # all the procedures on the way, so it's kept off meanwhile.
+    def __setstate__(self, state):
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            unpack(self, state)
+        finally:
+            if enabled:
+                gc.enable()
+
 class Argument(object):
+    annotation = None
+
     def __init__(self, proc, index):
         self.proc = proc
         self.index = index
@@ -38,7 +73,7 @@ class Block(object):
         self.succ = []
         self.idom = None
         self.phi = {}
-        self.frontiers = set()
+        self.frontiers = []
 
     def __str__(self):
         return "{:3}: {}{}".format(
@@ -54,6 +89,8 @@ class Block(object):
         return self.proc.blocks.index(self)
 
 class Instruction(object):
+    annotation = None
+
     def __init__(self, block, pc, name, args):
         self.block = block
         self.pc = pc
@@ -77,6 +114,8 @@ class Instruction(object):
 # may be substituted away early. Though it can be used to generate stack
 # traces later on.
 class Global(object):
+    annotation = None
+
     def __init__(self, block, pc, name):
         self.block = block
         self.pc = pc
@@ -86,6 +125,8 @@ class Global(object):
         return "(Global {})".format(self.name)
 
 class Phi(object):
+    annotation = None
+
     def __init__(self, block, args):
         self.block = block
         self.args = args
@@ -106,48 +147,85 @@ class Local(object):
     def __repr__(self):
         return "(Local {!r})".format(self.name)
 
-Tables = namedtuple('Tables', ['jump', 'labels', 'variables'])
+Tables = namedtuple('Tables', ['jump', 'start', 'labels', 'variables'])
 
 # This is supposed to be called through TranslationUnit, where the
 # results are memoized.
 def read(func):
-    proc = Procedure(func)
-    tables = Tables(
-        jump = {},
-        labels = findlabels(func.func_code.co_code),
-        variables = [Local(n) for n in func.func_code.co_varnames])
-    entry = interpret(proc, 0, [], tables)
-    assert len(entry.prec) == 0 # If this assertion fails, then code in the
-                                # interpret() for Arguments need to be fixed.
-    ssa_conversion(proc)
+    with profiling.phase('read', func):
+        proc = Procedure(func)
+        proc.bytecode = bytecode = Bytecode(func.func_code)
+        tables = Tables(
+            jump = {},
+            start = {},
+            labels = bytecode.labels,
+            variables = [Local(n) for n in func.func_code.co_varnames])
+        # The blocks are interpreted in depth first order, the same order
+        # in which recursing into the branches would visit them.
+        with profiling.phase('interpret'):
+            entry = branch(proc, 0, [], tables)
+            worklist = [entry]
+            visited = set()
+            while len(worklist) > 0:
+                block = worklist.pop()
+                if block not in visited:
+                    visited.add(block)
+                    interpret(proc, block, tables)
+                    worklist.extend(reversed(block.succ))
+        assert len(entry.prec) == 0 # If this assertion fails, then code in the
+                                    # interpret() for Arguments need to be fixed.
+        with profiling.phase('ssa_conversion'):
+            ssa_conversion(proc)
+    count_values(proc)
     return proc
 
-def interpret(proc, pc, cont, tables):
+# The sizes of the procedure go to the profile, if there's one.
+def count_values(proc):
+    if profiling.active is not None:
+        profiling.count('blocks', len(proc.blocks), proc.func)
+        profiling.count('instructions', sum(len(block.instructions) for block in proc.blocks), proc.func)
+        profiling.count('phis', sum(len(block.phi) for block in proc.blocks), proc.func)
+
+# Gives the block that starts from the pc. It's interpreted later.
+def branch(proc, pc, cont, tables):
     if pc in tables.jump:
         block, cont_ = tables.jump[pc]
         assert cont_ == cont, "An assumption that continuation table is not abused"
         return block
-    block = proc.new_block()
+    block = Block(proc)
     tables.jump[pc] = block, cont
+    tables.start[block] = pc, cont
+    return block
+
+def interpret(proc, block, tables):
+    proc.blocks.append(block)
+    pc, cont = tables.start[block]
     func_code = proc.func.func_code
-    co_code = func_code.co_code
     co_consts = func_code.co_consts
     co_names = func_code.co_names
+    offsets = proc.bytecode.offsets
+    opcodes = proc.bytecode.opcodes
+    args = proc.bytecode.args
     # If something branches into the entry node, it might cause phi -nodes
     # to be generated on arguments. The way to define arguments like this
     # will produce errors for such programs.
-    if block.index == 0:
+    if len(proc.blocks) == 1:
         for i in range(func_code.co_argcount):
-            block.defines[tables.variables[i]] = Argument(proc, i)
+            proc.arguments.append(Argument(proc, i))
+            block.defines[tables.variables[i]] = proc.arguments[i]
     stack = []
-    while pc < len(co_code):
-        org = pc
+    index = proc.bytecode.index[pc]
+    while index < len(opcodes):
+        org = offsets[index]
         if org in tables.labels and len(block.instructions) > 0:
             assert len(stack) == 0
             Instruction(block, org, 'fallthrough', [
-                interpret(proc, org, cont, jump_table, labels)])
+                branch(proc, org, cont, tables)])
             break
-        op, arg, pc = step(co_code, pc)
+        op = opcodes[index]
+        arg = args[index]
+        index += 1
+        pc = offsets[index]
         name = opcode.opname[op]
         if name == 'LOAD_CONST':
             stack.append(Instruction(block, org, 'const', [co_consts[arg]]))
@@ -161,24 +239,28 @@ def interpret(proc, pc, cont, tables):
         elif name == 'JUMP_ABSOLUTE':
             assert len(stack) == 0
             Instruction(block, org, 'jump', [
-                interpret(proc, arg, cont, tables)])
+                branch(proc, arg, cont, tables)])
             break
         elif name == 'JUMP_FORWARD':
             assert len(stack) == 0
             Instruction(block, org, 'jump', [
-                interpret(proc, pc+arg, cont, tables)])
+                branch(proc, pc+arg, cont, tables)])
             break
         elif name == 'POP_JUMP_IF_FALSE':
             assert len(stack) == 1
             Instruction(block, org, 'cond', [
                 stack.pop(),
-                interpret(proc, pc, cont, tables),
-                interpret(proc, arg, cont, tables)])
+                branch(proc, pc, cont, tables),
+                branch(proc, arg, cont, tables)])
             break
         elif name == 'POP_BLOCK':
             cont = cont[:-1]
         elif name == 'POP_TOP':
             stack.pop()
+        elif name == 'ROT_TWO':
+            stack[-2:] = [stack[-1], stack[-2]]
+        elif name == 'ROT_THREE':
+            stack[-3:] = [stack[-1], stack[-3], stack[-2]]
         elif name == 'RETURN_VALUE':
             assert len(stack) == 1
             Instruction(block, org, 'return', [stack.pop()])
@@ -189,17 +271,16 @@ def interpret(proc, pc, cont, tables):
             block.defines[tables.variables[arg]] = stack.pop()
         else:
             co_filename = func_code.co_filename
-            lineno = find_lineno(proc.func, org)
-            block = ["--> {} {} {}".format(org, name, arg)]
-            while pc < len(co_code) and len(block) < 5:
-                org = pc
-                op, arg, pc = step(co_code, pc)
-                name = opcode.opname[op]
-                block.append("    {} {} {}".format(org, name, arg))
+            lineno = proc.bytecode.lineno(org)
+            listing = ["--> {} {} {}".format(org, name, arg)]
+            while index < len(opcodes) and len(listing) < 5:
+                listing.append("    {} {} {}".format(
+                    offsets[index], opcode.opname[opcodes[index]], args[index]))
+                index += 1
             error_message = error_template.format(
                 co_filename,
                 lineno,
-                '\n'.join(block))
+                '\n'.join(listing))
             raise Exception(error_message)
     return block
 # Will be inserted back when they become useful.
@@ -230,142 +311,395 @@ def interpret(proc, pc, cont, tables):
 # The conversion must map every remaining Local to
 # a value: argument, phi, global or instruction.
 def ssa_conversion(proc):
-    entry = proc.blocks[0]
-    # Every path from entry to a block includes the immediate
-    # dominator of the block. We use this information to convert
-    # a depth first search into dominator search.
-    def depth_first_flow(block, prec):
-        if block is not entry and block.idom is None:
-            block.idom = prec
-            for succ in block.succ:
-                depth_first_flow(succ, block)
-    for succ in entry.succ:
-        depth_first_flow(succ, entry)
-    assert entry.idom is None
-    # Distance to entry lets to find a common dominator
-    # in the chain.
-    def distance(block):
-        count = 0
-        while block.idom is not None:
-            block = block.idom
-            count += 1
-        return count
-    def common_dominator(lhs, rhs):
-        lhs_d = distance(lhs)
-        rhs_d = distance(rhs)
-        while lhs_d > rhs_d:
-            lhs = lhs.idom
-            lhs_d -= 1
-        while rhs_d > lhs_d:
-            rhs = rhs.idom
-            rhs_d -= 1
-        while lhs != rhs:
-            lhs = lhs.idom
-            rhs = rhs.idom
-        return lhs
-    # In this way, finding the immediate dominators turn into
-    # a least-fixed-point computation. Common idom of the block
-    # must match idom of its precedent blocks.
-    adjust = True
-    while adjust:
-        adjust = False
-        for block in proc.blocks[1:]:
-            idom = reduce(common_dominator, block.prec)
-            adjust |= (idom <> block.idom)
-            block.idom = idom
-    # At this point we've got dominance figured out. Next we want
-    # to know where Locals are live.
-    adjust = True
-    while adjust:
-        adjust = False
+    # The dominator tree gives the idoms and dominance frontiers.
+    with profiling.phase('dominators'):
+        proc.dominators = tree = DominatorTree(proc.blocks[0])
         for block in proc.blocks:
-            L = len(block.depends)
-            for succ in block.succ:
-                block.depends.update(succ.depends)
-                block.depends.difference_update(block.defines)
-            if len(block.depends) > L:
-                adjust = True
-    # Next we recognize dominance frontiers. We cannot insert
-    # phi -nodes here, because phi-nodes themselves are definitions.
+            block.idom = tree.idom.get(block)
+            block.frontiers = tree.frontiers.get(block, [])
+    # At this point we've got dominance figured out. Next we want
+    # to know where Locals are live, and insert the phi-nodes there.
+    with profiling.phase('liveness'):
+        liveness(proc)
+    with profiling.phase('place_phis'):
+        place_phis(proc)
+    # Finally every Local is substituted with the value that reaches it.
+    with profiling.phase('rename'):
+        rename(proc)
+
+# Values are referred by their index in the tables, and blocks by
+# negative numbers. The constants come from code objects, so the whole
+# state can be marshaled. The annotations aren't packed, the procedures
+# are sent before annotation.
+def pack(proc):
+    blocks = dict((block, -1 - i) for i, block in enumerate(proc.blocks))
+    variables = {}
+    values = {}
+    for value in proc.values():
+        values[value] = len(values)
+    def variable_index(variable):
+        if variable not in variables:
+            variables[variable] = len(variables)
+        return variables[variable]
+    def ref(x):
+        if x in values:
+            return values[x]
+        if x in blocks:
+            return blocks[x]
+        if isinstance(x, Local):
+            return ('local', variable_index(x))
+        if isinstance(x, Global):
+            values[x] = len(values)
+            return values[x]
+        return ('const', x)
+    records = []
+    for value in proc.values():
+        if isinstance(value, Argument):
+            records.append(('argument', value.index))
+        elif isinstance(value, Phi):
+            records.append(('phi', blocks[value.block], value.result_id,
+                tuple((blocks[prec], ref(arg)) for prec, arg in value.args.items())))
+        else:
+            records.append(('instruction', blocks[value.block], value.pc,
+                value.name, tuple(map(ref, value.args)), value.result_id))
+    packed_blocks = []
+    for block in proc.blocks:
+        packed_blocks.append((
+            tuple(variable_index(variable) for variable in block.depends),
+            tuple((variable_index(variable), ref(value))
+                for variable, value in block.defines.items()),
+            tuple((variable_index(variable), values[phi])
+                for variable, phi in block.phi.items()),
+            tuple(values[instruction] for instruction in block.instructions),
+            tuple(blocks[prec] for prec in block.prec),
+            tuple(blocks[succ] for succ in block.succ)))
+    # The globals were numbered on the way.
+    for value in sorted(values, key=values.get)[len(records):]:
+        records.append(('global', blocks[value.block], value.pc, value.name))
+    tree = getattr(proc, 'dominators', None)
+    if tree is not None:
+        idom, frontiers = tree.numbers()
+        tree = (tuple(-1 - blocks[block] for block in tree.order),
+            tuple(idom), tuple(map(tuple, frontiers)))
+    next_id = next(proc.counter)
+    proc.counter = itertools.count(next_id)
+    bytecode = getattr(proc, 'bytecode', None)
+    return marshal.dumps((
+        next_id,
+        bytecode.__getstate__() if bytecode is not None else None,
+        tuple(variable.name for variable in sorted(variables, key=variables.get)),
+        tuple(records),
+        tuple(values[argument] for argument in proc.arguments),
+        tuple(packed_blocks),
+        tree))
+
+def unpack(proc, state):
+    next_id, bytecode, names, records, arguments, packed_blocks, tree = marshal.loads(state)
+    proc.func = None
+    proc.counter = itertools.count(next_id)
+    proc.bytecode = None
+    if bytecode is not None:
+        proc.bytecode = Bytecode.__new__(Bytecode)
+        proc.bytecode.__setstate__(bytecode)
+    proc.blocks = blocks = [Block.__new__(Block) for _ in packed_blocks]
+    blocks.reverse() # So that blocks[-1 - i] is the block i.
+    variables = [Local(name) for name in names]
+    kinds = {'argument':Argument, 'phi':Phi, 'instruction':Instruction, 'global':Global}
+    values = [kinds[record[0]].__new__(kinds[record[0]]) for record in records]
+    def deref(x):
+        if x.__class__ is int:
+            return values[x] if x >= 0 else blocks[x]
+        if x[0] == 'local':
+            return variables[x[1]]
+        return x[1]
+    for value, record in zip(values, records):
+        kind = record[0]
+        if kind == 'argument':
+            value.proc = proc
+            value.index = record[1]
+        elif kind == 'phi':
+            value.block = blocks[record[1]]
+            value.result_id = record[2]
+            value.args = dict((blocks[prec], deref(arg)) for prec, arg in record[3])
+        elif kind == 'instruction':
+            value.block = blocks[record[1]]
+            value.pc = record[2]
+            value.name = record[3]
+            value.args = map(deref, record[4])
+            value.result_id = record[5]
+        else:
+            value.block = blocks[record[1]]
+            value.pc = record[2]
+            value.name = record[3]
+    proc.arguments = [values[i] for i in arguments]
+    for i, (depends, defines, phi, instructions, prec, succ) in enumerate(packed_blocks):
+        block = blocks[-1 - i]
+        block.proc = proc
+        block.depends = set(variables[j] for j in depends)
+        block.defines = dict((variables[j], deref(value)) for j, value in defines)
+        block.phi = dict((variables[j], values[k]) for j, k in phi)
+        block.instructions = [values[j] for j in instructions]
+        block.prec = [blocks[j] for j in prec]
+        block.succ = [blocks[j] for j in succ]
+    blocks.reverse()
+    for block in blocks:
+        block.idom = None
+        block.frontiers = []
+    if tree is not None:
+        order, idom, frontiers = tree
+        proc.dominators = tree = DominatorTree.__new__(DominatorTree)
+        tree.fill([blocks[i] for i in order], idom, frontiers)
+        for block in tree.order:
+            block.idom = tree.idom[block]
+            block.frontiers = tree.frontiers[block]
+
+# Immediate dominators by Cooper, Harvey & Kennedy, "A Simple, Fast
+# Dominance Algorithm". Blocks are numbered in reverse postorder, so the
+# idom of a block always has a smaller number than the block itself.
+# Two paths up the tree are intersected by walking the one with the
+# larger number, until they meet. It takes few passes over the blocks,
+# unless the loops in the flow graph are nested very deep.
+class DominatorTree(object):
+    def __init__(self, entry):
+        self.entry = entry
+        self.order = reverse_postorder(entry)
+        self.number = number = dict((block, i) for i, block in enumerate(self.order))
+        precs = [[number[prec] for prec in block.prec if prec in number]
+            for block in self.order]
+        idom = [None] * len(self.order)
+        idom[0] = 0
+        changed = True
+        while changed:
+            changed = False
+            for i in range(1, len(self.order)):
+                new_idom = None
+                for p in precs[i]:
+                    if idom[p] is None:
+                        continue
+                    if new_idom is None:
+                        new_idom = p
+                        continue
+                    a = p
+                    while a != new_idom:
+                        while a > new_idom:
+                            a = idom[a]
+                        while new_idom > a:
+                            new_idom = idom[new_idom]
+                if idom[i] != new_idom:
+                    idom[i] = new_idom
+                    changed = True
+        # Block is in the dominance frontier of every block from its
+        # precedents up to, but not including, its idom. The frontiers
+        # are listed in reverse postorder, so that the phi-nodes are
+        # numbered the same way on every run.
+        frontiers = [set() for block in self.order]
+        for i, block in enumerate(self.order):
+            if len(precs[i]) >= 2:
+                for runner in precs[i]:
+                    while runner != idom[i]:
+                        frontiers[runner].add(i)
+                        runner = idom[runner]
+        self.fill(self.order, idom, map(sorted, frontiers))
+
+    # Fills the tree from the idoms and frontiers given as numbers in
+    # the reverse postorder. Unpacked procedures get their tree this way.
+    def fill(self, order, idom, frontiers):
+        self.entry = order[0]
+        self.order = order
+        self.number = dict((block, i) for i, block in enumerate(order))
+        # Depths can be filled in the same order, as idoms come first.
+        depth = [0] * len(order)
+        for i in range(1, len(order)):
+            depth[i] = depth[idom[i]] + 1
+        self.idom = {self.entry:None}
+        self.depth = {}
+        self.children = dict((block, []) for block in order)
+        for i, block in enumerate(order):
+            self.depth[block] = depth[i]
+            if i > 0:
+                self.idom[block] = parent = order[idom[i]]
+                self.children[parent].append(block)
+        self.frontiers = dict((block, [order[j] for j in frontiers[i]])
+            for i, block in enumerate(order))
+
+    # The tree as numbers, for fill().
+    def numbers(self):
+        number = self.number
+        return ([number[self.idom[block]] if block is not self.entry else 0
+                for block in self.order],
+            [[number[frontier] for frontier in self.frontiers[block]]
+                for block in self.order])
+
+    def dominates(self, a, b):
+        while self.depth[b] > self.depth[a]:
+            b = self.idom[b]
+        return a is b
+
+    # Parents are visited before their children.
+    def preorder(self):
+        stack = [self.entry]
+        while len(stack) > 0:
+            block = stack.pop()
+            yield block
+            stack.extend(reversed(self.children[block]))
+
+def reverse_postorder(entry):
+    order = []
+    visited = set([entry])
+    stack = [(entry, iter(entry.succ))]
+    while len(stack) > 0:
+        block, succs = stack[-1]
+        for succ in succs:
+            if succ not in visited:
+                visited.add(succ)
+                stack.append((succ, iter(succ.succ)))
+                break
+        else:
+            stack.pop()
+            order.append(block)
+    order.reverse()
+    return order
+
+# Before this, block.depends holds the Locals the block reads before
+# defining them. A variable is live at the entry of every block on a
+# path from such a use back to a definition, so we walk the precedents
+# of the uses, one variable at a time, and stop at the definitions.
+# Afterwards block.depends holds the Locals live at the entry.
+def liveness(proc):
+    uses = {}
     for block in proc.blocks:
-        if len(block.prec) >= 2:
-            for prec in block.prec:
-                runner = prec
-                while runner != block.idom:
-                    runner.frontiers.add(block)
-                    runner = runner.idom
-    # Now it's time to insert the phi-nodes.
+        for variable in block.depends:
+            uses.setdefault(variable, []).append(block)
+    for variable, worklist in uses.items():
+        while len(worklist) > 0:
+            for prec in worklist.pop().prec:
+                if variable not in prec.defines and variable not in prec.depends:
+                    prec.depends.add(variable)
+                    worklist.append(prec)
+
+# phi-node insertion can be understood as yet another definition.
+# therefore when inserting a phi-node, the dominance frontiers of
+# that block need phi-nodes too. Phi-nodes are only inserted where
+# the variable is live, the others would never be used. The variables
+# go in order of their names, so the phi-nodes get the same result ids
+# on every run.
+def place_phis(proc):
+    definitions = {}
     for block in proc.blocks:
-        for frontier in block.frontiers:
+        for variable in block.defines:
+            definitions.setdefault(variable, []).append(block)
+    for variable in sorted(definitions, key=lambda variable: variable.name):
+        worklist = definitions[variable]
+        visited = set(worklist)
+        while len(worklist) > 0:
+            for frontier in worklist.pop().frontiers:
+                if variable in frontier.depends and variable not in frontier.phi:
+                    frontier.phi[variable] = Phi(frontier, {})
+                    if frontier not in visited:
+                        visited.add(frontier)
+                        worklist.append(frontier)
+
+# Walks the dominator tree and keeps a stack of values for every
+# variable, the top is the value that reaches the current point. Every
+# Local in the instructions is read at the entry of its block, and the
+# phi-nodes in the successors read the values at the exit. Values are
+# pushed on entering a block and popped when leaving its subtree.
+def rename(proc):
+    stacks = {}
+    def current(block, variable, pc):
+        stack = stacks.get(variable)
+        if not stack:
+            raise Exception(undefined_template.format(variable.name,
+                proc.func.func_code.co_filename, proc.bytecode.lineno(pc)))
+        return stack[-1]
+    walk = [(proc.dominators.entry, False)]
+    while len(walk) > 0:
+        block, leaving = walk.pop()
+        if leaving:
+            for variable in block.phi:
+                stacks[variable].pop()
             for variable in block.defines:
-                insert_phi(frontier, variable)
-    # Next fill in the dominating flow into the phi-nodes and
-    # substitute every Local with it's lookup value.
-    # These operations are independent, so they can be done
-    # inside the same loop.
-    for block in proc.blocks:
-        for prec in block.prec:
-            for variable, phi in block.phi.items():
-                phi.args[prec] = lookup(prec, variable)
+                stacks[variable].pop()
+            continue
+        walk.append((block, True))
+        for variable, phi in block.phi.items():
+            stacks.setdefault(variable, []).append(phi)
         for instruction in block.instructions:
             for i, arg in enumerate(instruction.args):
                 if isinstance(arg, Local):
-                    instruction.args[i] = lookup_up(block, arg)
+                    instruction.args[i] = current(block, arg, instruction.pc)
+        pc = block.instructions[-1].pc if len(block.instructions) > 0 else 0
+        values = [(variable, current(block, value, pc) if isinstance(value, Local) else value)
+            for variable, value in block.defines.items()]
+        for variable, value in values:
+            stacks.setdefault(variable, []).append(value)
+        for succ in block.succ:
+            for variable, phi in succ.phi.items():
+                phi.args[block] = current(block, variable, pc)
+        for child in reversed(proc.dominators.children[block]):
+            walk.append((child, False))
 
-# phi-node insertion can be understood as yet another definition.
-# therefore when inserting a phi-node, you need to trigger the
-# insertion for dominance frontiers of the current block.
-def insert_phi(block, variable):
-    if variable in block.depends and variable not in block.phi:
-        block.phi[variable] = Phi(block, {})
-        for frontier in block.frontiers:
-            insert_phi(frontier, variable)
-
-# lookup & lookup_up are guarranteed to return a value 
-# (and not a Local) once we have dominators figured out.
-# They are mutually recursive.
-def lookup(block, variable):
-    if variable in block.defines:
-        value = block.defines[variable]
-        if isinstance(value, Local):
-            return lookup_up(block, value)
-        return value
-    return lookup_up(block, variable)
-
-# Difference between lookup and lookup_up is that lookup
-# looks for variable from the definitions of the block.
-def lookup_up(block, variable):
-    if variable in block.phi:
-        return block.phi[variable]
-    return lookup(block.idom, variable)
-
-def decode_lnotab(func):
-    t = func.func_code.co_lnotab
-    return [(ord(t[i]), ord(t[i+1])) for i in range(0, len(t), 2)]
-
-def find_lineno(func, pc):
-    co_lnotab = decode_lnotab(func)
-    lineno = func.func_code.co_firstlineno
-    addr = 0
-    for addr_incr, line_incr in co_lnotab:
-        addr += addr_incr
-        if addr > pc:
-            return lineno
-        lineno += line_incr
-    return lineno
-
-# Almost all there is to decoding python instructions.
-def step(co_code, pc):
-    op = ord(co_code[pc])
-    if op >= opcode.HAVE_ARGUMENT:
-        b0 = ord(co_code[pc+1])
-        b1 = ord(co_code[pc+2])
-        arg = b0 | b1 << 16
-        pc += 3
-    else:
-        arg = 0
-        pc += 1
-    return op, arg, pc
+# The bytecode is decoded once into arrays, one entry per instruction,
+# with EXTENDED_ARG folded into the argument of the next instruction.
+# offsets[i+1] is where the instruction i ends, the arrays have an extra
+# offset at the end for that.
+class Bytecode(object):
+    def __init__(self, code):
+        self.offsets = offsets = array('l')
+        self.opcodes = opcodes = array('B')
+        self.args = args = array('l')
+        self.labels = labels = set()
+        data = array('B', code.co_code)
+        pc = 0
+        start = 0
+        extended = 0
+        while pc < len(data):
+            op = data[pc]
+            if op >= have_argument:
+                arg = data[pc+1] | data[pc+2] << 8 | extended
+                pc += 3
+                if op == extended_arg:
+                    extended = arg << 16
+                    continue
+                extended = 0
+                if op in hasjrel:
+                    labels.add(pc + arg)
+                elif op in hasjabs:
+                    labels.add(arg)
+            else:
+                arg = 0
+                pc += 1
+            offsets.append(start)
+            opcodes.append(op)
+            args.append(arg)
+            start = pc
+        offsets.append(pc)
+        self.index = dict((offset, i) for i, offset in enumerate(offsets))
+        self.line_starts = []
+        self.line_numbers = []
+        for offset, lineno in findlinestarts(code):
+            self.line_starts.append(offset)
+            self.line_numbers.append(lineno)
+
+    def __getstate__(self):
+        return (self.offsets.tostring(), self.opcodes.tostring(), self.args.tostring(),
+            tuple(self.labels), tuple(self.line_starts), tuple(self.line_numbers))
+
+    def __setstate__(self, state):
+        offsets, opcodes, args, labels, self.line_starts, self.line_numbers = state
+        self.offsets = array('l', offsets)
+        self.opcodes = array('B', opcodes)
+        self.args = array('l', args)
+        self.labels = set(labels)
+        self.index = dict((offset, i) for i, offset in enumerate(self.offsets))
+
+    def lineno(self, pc):
+        return self.line_numbers[max(0, bisect_right(self.line_starts, pc) - 1)]
+
+have_argument = opcode.HAVE_ARGUMENT
+extended_arg = opcode.EXTENDED_ARG
+hasjrel = frozenset(opcode.hasjrel)
+hasjabs = frozenset(opcode.hasjabs)
 
 # Will get their own module soon.
 #class Binop(object):
@@ -383,6 +717,9 @@ def step(co_code, pc):
 #}
 
 # Error template for messaging about bad instruction.
+undefined_template = """Variable {!r} may be used before it is assigned.
+  File {!r}, line {}"""
+
 error_template = """Operation not accepted by the target language.
   File {!r}, line {}
 {}"""
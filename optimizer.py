@@ -0,0 +1,392 @@
+import math
+import struct
+import spirv
+
+# Optimizations over decoded modules, such as the ones from
+# spirv.decode_spirv, or the ones the translator emits. The passes
+# return new instruction lists, and the ids keep their numbers, so the
+# result encodes with the bound of the original module.
+def optimize(instructions, fold=True, eliminate=True):
+    if fold:
+        instructions = fold_constants(instructions)
+    if eliminate:
+        instructions = eliminate_dead_code(instructions)
+    return instructions
+
+# Arithmetic on scalar OpConstants is computed here, and the results
+# become OpConstants in the globals section, with the result ids they
+# had. Results of folding are folded further. Division by zero and
+# overlong shifts are left for the target to decide.
+def fold_constants(instructions):
+    types = {}     # result id -> ('int', width, signed) or ('float', width)
+    constants = {} # result id -> (type, value), ints are kept unsigned
+    folded = []
+    output = []
+    for instruction in instructions:
+        if isinstance(instruction, spirv.UnknownInstruction):
+            output.append(instruction)
+            continue
+        name = instruction.name
+        if name == 'OpTypeInt' and instruction.args[0] in (32, 64):
+            types[instruction.result_id] = ('int', instruction.args[0], bool(instruction.args[1]))
+        elif name == 'OpTypeFloat' and instruction.args[0] in (32, 64):
+            types[instruction.result_id] = ('float', instruction.args[0])
+        elif name == 'OpConstant' and instruction.type_id in types:
+            type = types[instruction.type_id]
+            if len(instruction.args[0]) == type[1] // 32:
+                constants[instruction.result_id] = type, decode_constant(type, instruction.args[0])
+        elif name in folders and instruction.type_id in types:
+            type = types[instruction.type_id]
+            value = fold(folders[name], type, instruction.args, constants)
+            if value is not None:
+                constants[instruction.result_id] = type, value
+                folded.append(spirv.Instruction('OpConstant',
+                    instruction.type_id, instruction.result_id,
+                    [encode_constant(type, value)]))
+                continue
+        output.append(instruction)
+    if len(folded) > 0:
+        index = first_function(output)
+        output[index:index] = folded
+    return output
+
+# The operands must be of the same kind and width as the result.
+def fold(folder, type, args, constants):
+    kind, width = type[0], type[1]
+    if folder[0] != kind:
+        return None
+    values = []
+    for arg in args:
+        if arg.result_id not in constants:
+            return None
+        type_, value = constants[arg.result_id]
+        if type_[:2] != (kind, width):
+            return None
+        values.append(value)
+    if kind == 'int':
+        mask = (1 << width) - 1
+        value = folder[1](width, *values)
+        return None if value is None else value & mask
+    value = folder[1](*values)
+    return None if value is None else round_float(width, value, values)
+
+def first_function(instructions):
+    for index, instruction in enumerate(instructions):
+        if getattr(instruction, 'name', None) == 'OpFunction':
+            return index
+    return len(instructions)
+
+def decode_constant(type, words):
+    if type[0] == 'int':
+        return sum(word << (32 * i) for i, word in enumerate(words))
+    if type[1] == 32:
+        return struct.unpack('<f', struct.pack('<I', words[0]))[0]
+    return struct.unpack('<d', struct.pack('<II', *words))[0]
+
+def encode_constant(type, value):
+    if type[0] == 'int':
+        return [value >> (32 * i) & 0xFFFFFFFF for i in range(type[1] // 32)]
+    if type[1] == 32:
+        return list(struct.unpack('<I', struct.pack('<f', value)))
+    return list(struct.unpack('<II', struct.pack('<d', value)))
+
+# Results that overflow aren't folded: the ones that don't fit in a
+# float, and the ones that aren't finite while the operands were.
+def round_float(width, value, operands):
+    if width == 32:
+        try:
+            value = struct.unpack('<f', struct.pack('<f', value))[0]
+        except OverflowError:
+            return None
+    if not finite(value) and all(finite(operand) for operand in operands):
+        return None
+    return value
+
+def finite(value):
+    return not (math.isinf(value) or math.isnan(value))
+
+def signed(width, value):
+    return value - (1 << width) if value >> (width - 1) else value
+
+# Division truncates toward zero. SRem takes the sign of the dividend
+# and SMod the sign of the divisor.
+def sdiv(width, a, b):
+    a, b = signed(width, a), signed(width, b)
+    if b == 0:
+        return None
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+def srem(width, a, b):
+    a, b = signed(width, a), signed(width, b)
+    if b == 0:
+        return None
+    remainder = abs(a) % abs(b)
+    return -remainder if a < 0 else remainder
+
+def smod(width, a, b):
+    a, b = signed(width, a), signed(width, b)
+    if b == 0:
+        return None
+    return a % b
+
+def shift(width, b):
+    return b if b < width else None
+
+def fdiv(a, b):
+    return a / b if b != 0 else None
+
+folders = {
+    'OpIAdd': ('int', lambda w, a, b: a + b),
+    'OpISub': ('int', lambda w, a, b: a - b),
+    'OpIMul': ('int', lambda w, a, b: a * b),
+    'OpUDiv': ('int', lambda w, a, b: a // b if b != 0 else None),
+    'OpUMod': ('int', lambda w, a, b: a % b if b != 0 else None),
+    'OpSDiv': ('int', sdiv),
+    'OpSRem': ('int', srem),
+    'OpSMod': ('int', smod),
+    'OpSNegate': ('int', lambda w, a: -a),
+    'OpNot': ('int', lambda w, a: ~a),
+    'OpBitwiseAnd': ('int', lambda w, a, b: a & b),
+    'OpBitwiseOr': ('int', lambda w, a, b: a | b),
+    'OpBitwiseXor': ('int', lambda w, a, b: a ^ b),
+    'OpShiftLeftLogical': ('int', lambda w, a, b:
+        a << b if shift(w, b) is not None else None),
+    'OpShiftRightLogical': ('int', lambda w, a, b:
+        a >> b if shift(w, b) is not None else None),
+    'OpShiftRightArithmetic': ('int', lambda w, a, b:
+        signed(w, a) >> b if shift(w, b) is not None else None),
+    'OpFAdd': ('float', lambda a, b: a + b),
+    'OpFSub': ('float', lambda a, b: a - b),
+    'OpFMul': ('float', lambda a, b: a * b),
+    'OpFDiv': ('float', fdiv),
+    'OpFNegate': ('float', lambda a: -a),
+}
+
+# Instructions that do nothing else than compute their result, and
+# can be removed when the result isn't used.
+pure = set(name for name in spirv.opname_table
+    if name.startswith(('OpType', 'OpConstant', 'OpSpecConstant'))) | set(folders) | set([
+    'OpVariable', 'OpVariableArray', 'OpUndef', 'OpString', 'OpLoad',
+    'OpAccessChain', 'OpInBoundsAccessChain', 'OpCopyObject', 'OpSelect',
+    'OpPhi', 'OpVectorExtractDynamic', 'OpVectorInsertDynamic',
+    'OpVectorShuffle', 'OpCompositeConstruct', 'OpCompositeExtract',
+    'OpCompositeInsert', 'OpTranspose', 'OpDot', 'OpOuterProduct',
+    'OpVectorTimesScalar', 'OpMatrixTimesScalar', 'OpVectorTimesMatrix',
+    'OpMatrixTimesVector', 'OpMatrixTimesMatrix', 'OpFRem', 'OpFMod',
+    'OpConvertFToU', 'OpConvertFToS', 'OpConvertSToF', 'OpConvertUToF',
+    'OpUConvert', 'OpSConvert', 'OpFConvert', 'OpBitcast',
+    'OpIEqual', 'OpINotEqual', 'OpUGreaterThan', 'OpSGreaterThan',
+    'OpUGreaterThanEqual', 'OpSGreaterThanEqual', 'OpULessThan', 'OpSLessThan',
+    'OpULessThanEqual', 'OpSLessThanEqual', 'OpFOrdEqual', 'OpFUnordEqual',
+    'OpFOrdNotEqual', 'OpFUnordNotEqual', 'OpFOrdLessThan', 'OpFUnordLessThan',
+    'OpFOrdGreaterThan', 'OpFUnordGreaterThan', 'OpFOrdLessThanEqual',
+    'OpFUnordLessThanEqual', 'OpFOrdGreaterThanEqual',
+    'OpFUnordGreaterThanEqual', 'OpLessOrGreater', 'OpLogicalAnd',
+    'OpLogicalOr', 'OpLogicalXor', 'OpAny', 'OpAll', 'OpIsNan', 'OpIsInf',
+])
+
+# Debug and annotation instructions that stay only as long as their
+# target does.
+attached = set(['OpName', 'OpMemberName', 'OpDecorate', 'OpMemberDecorate'])
+
+# Variables in these storage classes can't be seen outside the module.
+internal = set(['Function', 'Private', 'PrivateGlobal', 'WorkgroupLocal', 'WorkgroupGlobal'])
+
+# Removes the instructions whose results aren't used, along with the
+# globals, types and functions nobody refers to. In the functions that
+# are kept, everything without a result or with side effects stays.
+# Functions are kept if an entry point or a kept function call refers
+# to them, or all of them if there are no entry points. Variables in
+# the interface of the module stay, and decoration groups lose the
+# targets that were removed. The references of unknown instructions
+# can't be followed, so such modules are left as they are.
+def eliminate_dead_code(instructions):
+    if any(isinstance(instruction, spirv.UnknownInstruction) for instruction in instructions):
+        return list(instructions)
+    definitions = {}
+    functions = {}   # function id -> instructions that are kept if it is
+    roots = []
+    live = set()
+    function = None
+    library = not any(instruction.name == 'OpEntryPoint' for instruction in instructions)
+    for instruction in instructions:
+        name = instruction.name
+        if instruction.result_id != 0:
+            definitions[instruction.result_id] = instruction
+        if name == 'OpFunction':
+            function = instruction.result_id
+            functions[function] = []
+            if library:
+                roots.append(instruction)
+        if function is not None:
+            if name not in pure:
+                functions[function].append(instruction)
+        elif name not in pure and name not in attached and not name.startswith('OpGroup'):
+            roots.append(instruction)
+        elif name in ('OpVariable', 'OpVariableArray') and instruction.args[0] not in internal:
+            live.add(instruction.result_id)
+            roots.append(instruction)
+        if name == 'OpFunctionEnd':
+            function = None
+    worklist = roots
+    while len(worklist) > 0:
+        instruction = worklist.pop()
+        for result_id in references(instruction):
+            if result_id not in live and result_id in definitions:
+                live.add(result_id)
+                worklist.append(definitions[result_id])
+                worklist.extend(functions.get(result_id, ()))
+        if instruction.name == 'OpFunction' and instruction.result_id not in live:
+            live.add(instruction.result_id)
+            worklist.extend(functions[instruction.result_id])
+    # Decoration groups are live if some live target uses them.
+    for instruction in instructions:
+        if instruction.name in ('OpGroupDecorate', 'OpGroupMemberDecorate'):
+            if any(target.result_id in live for target in instruction.args[1]):
+                live.add(instruction.args[0].result_id)
+    output = []
+    function = None
+    for instruction in instructions:
+        name = instruction.name
+        if name == 'OpFunction':
+            function = instruction.result_id
+        if function is not None and function not in live:
+            pass
+        elif name in attached:
+            if instruction.args[0].result_id in live:
+                output.append(instruction)
+        elif name in ('OpGroupDecorate', 'OpGroupMemberDecorate'):
+            targets = [target for target in instruction.args[1] if target.result_id in live]
+            if len(targets) > 0:
+                output.append(spirv.Instruction(name, instruction.type_id,
+                    instruction.result_id, [instruction.args[0], targets]))
+        elif name == 'OpDecorationGroup' or name in pure:
+            if instruction.result_id in live:
+                output.append(instruction)
+        else:
+            output.append(instruction)
+        if name == 'OpFunctionEnd':
+            function = None
+    return output
+
+# The ids an instruction refers to, its result type included.
+def references(instruction):
+    result = []
+    if instruction.type_id != 0:
+        result.append(instruction.type_id)
+    stack = list(instruction.args)
+    while len(stack) > 0:
+        arg = stack.pop()
+        if isinstance(arg, spirv.Id):
+            result.append(arg.result_id)
+        elif isinstance(arg, (list, tuple)):
+            stack.extend(arg)
+    return result
+
+# Shrinks a module for shipping. Identical types and constants are
+# merged, debug instructions are stripped if asked, and the ids are
+# renumbered densely in the order they are defined. Returns the
+# instructions along with the new bound. The ids inside unknown
+# instructions can't be followed, so such modules only lose the debug
+# instructions, and keep the bound they were given.
+def compact(instructions, bound, strip=False):
+    if strip:
+        instructions = strip_debug(instructions)
+    if any(isinstance(instruction, spirv.UnknownInstruction) for instruction in instructions):
+        return list(instructions), bound
+    instructions = deduplicate(instructions)
+    return renumber(instructions)
+
+# Types and constants are merged when they are the same instruction
+# once the earlier merges are applied. The ones with decorations stay
+# apart, as they may be different for the target, and so do opaque
+# types and spec constants. Names of the removed ids go with them.
+def deduplicate(instructions):
+    decorated = set()
+    for instruction in instructions:
+        if instruction.name in ('OpDecorate', 'OpMemberDecorate'):
+            decorated.add(instruction.args[0].result_id)
+        elif instruction.name in ('OpGroupDecorate', 'OpGroupMemberDecorate'):
+            decorated.update(target.result_id for target in instruction.args[1])
+    canonical = {}
+    mapping = {}
+    for instruction in instructions:
+        if instruction.name in mergeable and instruction.result_id not in decorated:
+            key = (instruction.name, mapping.get(instruction.type_id, instruction.type_id),
+                freeze(instruction.args, mapping))
+            if key in canonical:
+                mapping[instruction.result_id] = canonical[key]
+            else:
+                canonical[key] = instruction.result_id
+    if not mapping:
+        return list(instructions)
+    output = []
+    ids = spirv.IdTable()
+    for instruction in instructions:
+        if instruction.result_id in mapping:
+            continue
+        if instruction.name in ('OpName', 'OpMemberName') and instruction.args[0].result_id in mapping:
+            continue
+        output.append(remap(instruction, mapping, ids))
+    return output
+
+mergeable = set(name for name in spirv.opname_table
+    if name.startswith(('OpType', 'OpConstant'))) - set(['OpTypeOpaque'])
+
+def freeze(arg, mapping):
+    if isinstance(arg, spirv.Id):
+        return ('id', mapping.get(arg.result_id, arg.result_id))
+    if isinstance(arg, (list, tuple)):
+        return tuple(freeze(item, mapping) for item in arg)
+    if isinstance(arg, set):
+        return frozenset(arg)
+    return arg
+
+# Ids are numbered from 1 in the order they are defined. Ids that are
+# referred to but never defined come after the others.
+def renumber(instructions):
+    mapping = {}
+    for instruction in instructions:
+        if instruction.result_id != 0:
+            mapping[instruction.result_id] = len(mapping) + 1
+    for instruction in instructions:
+        for result_id in references(instruction):
+            if result_id not in mapping:
+                mapping[result_id] = len(mapping) + 1
+    ids = spirv.IdTable()
+    return [remap(instruction, mapping, ids) for instruction in instructions], len(mapping) + 1
+
+# Returns the instruction with its ids replaced through the mapping.
+# The ids that aren't in the mapping stay as they are. Pass the same
+# table for a whole module, so every id gets a single Id object, like
+# from the decoder.
+def remap(instruction, mapping, ids):
+    return spirv.Instruction(instruction.name,
+        mapping.get(instruction.type_id, instruction.type_id),
+        mapping.get(instruction.result_id, instruction.result_id),
+        [remap_arg(arg, mapping, ids) for arg in instruction.args])
+
+def remap_arg(arg, mapping, ids):
+    if isinstance(arg, spirv.Id):
+        return ids[mapping.get(arg.result_id, arg.result_id)]
+    if isinstance(arg, list):
+        return [remap_arg(item, mapping, ids) for item in arg]
+    if isinstance(arg, tuple):
+        return tuple(remap_arg(item, mapping, ids) for item in arg)
+    return arg
+
+# Names, source information and line numbers don't change what the
+# module does. Strings stay if something else still refers to them.
+def strip_debug(instructions):
+    output = [instruction for instruction in instructions
+        if getattr(instruction, 'name', None) not in debug]
+    used = set()
+    for instruction in output:
+        if isinstance(instruction, spirv.UnknownInstruction):
+            return output
+        used.update(references(instruction))
+    return [instruction for instruction in output
+        if instruction.name != 'OpString' or instruction.result_id in used]
+
+debug = set(['OpSource', 'OpSourceExtension', 'OpName', 'OpMemberName', 'OpLine'])
@@ -0,0 +1,146 @@
+import json
+import time
+
+# Tells where the translation spends its time. The phases of the
+# pipeline are timed, per function where there is one, and the counts
+# of blocks, instructions, phis, annotator iterations and cache hits
+# are collected along with them. Profiling is off unless a Profile is
+# entered:
+#
+#     with profiling.Profile() as profile:
+#         unit.build_function(functype, func)
+#     print profile.report()
+#
+# When it's off, the hooks cost a global lookup and a call, once per
+# phase, never per instruction.
+active = None
+
+class Profile(object):
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.phases = {}    # phase -> [calls, seconds]
+        self.counters = {}  # counter -> total
+        self.functions = {} # function name -> {phase or counter: total}
+        self.folded = {}    # path of phases -> seconds spent in the last one
+        self.events = []    # (phase, function name, start, duration, depth)
+        self.stack = []     # [phase, function name, start, seconds of children]
+        self.previous = None
+
+    def __enter__(self):
+        global active
+        self.previous = active
+        active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global active
+        active = self.previous
+        self.previous = None
+
+    def phase(self, name, func=None):
+        return Phase(self, name, func)
+
+    def enter(self, name, func):
+        self.stack.append([name, func, self.clock(), 0.0])
+
+    def exit(self):
+        path = tuple(label(name, func) for name, func, start, children in self.stack)
+        name, func, start, children = self.stack.pop()
+        duration = self.clock() - start
+        entry = self.phases.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += duration
+        if func is not None:
+            record = self.functions.setdefault(func, {})
+            record[name] = record.get(name, 0.0) + duration
+        self.folded[path] = self.folded.get(path, 0.0) + duration - children
+        if len(self.stack) > 0:
+            self.stack[-1][3] += duration
+        self.events.append((name, func, start, duration, len(self.stack)))
+
+    def count(self, name, amount=1, func=None):
+        self.counters[name] = self.counters.get(name, 0) + amount
+        if func is not None:
+            record = self.functions.setdefault(func, {})
+            record[name] = record.get(name, 0) + amount
+
+    def report(self):
+        lines = ['phase                      calls    seconds']
+        for name, (calls, seconds) in sorted(self.phases.items(),
+                key=lambda item: -item[1][1]):
+            lines.append('{:<24} {:>7} {:>10.4f}'.format(name, calls, seconds))
+        if len(self.counters) > 0:
+            lines.append('')
+            for name, total in sorted(self.counters.items()):
+                lines.append('{:<24} {:>18}'.format(name, total))
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return 'Profile(phases={}, counters={})'.format(
+            dict((name, seconds) for name, (calls, seconds) in self.phases.items()),
+            self.counters)
+
+    # The trace event format read by chrome://tracing and Perfetto.
+    # Times are in microseconds from the start of the first phase.
+    def write_trace(self, fd):
+        origin = min([start for name, func, start, duration, depth in self.events] or [0])
+        events = []
+        for name, func, start, duration, depth in self.events:
+            event = {'name':label(name, func), 'cat':name, 'ph':'X', 'pid':0, 'tid':0,
+                'ts':(start - origin) * 1e6, 'dur':duration * 1e6}
+            if func is not None:
+                event['args'] = dict((key, value)
+                    for key, value in self.functions[func].items()
+                    if key in self.counters)
+            events.append(event)
+        json.dump({'traceEvents':events, 'displayTimeUnit':'ms'}, fd)
+
+    # One line per stack of phases with the microseconds spent in it,
+    # the input of flamegraph.pl and speedscope.
+    def write_folded(self, fd):
+        for path, seconds in sorted(self.folded.items()):
+            fd.write('{} {}\n'.format(';'.join(path), int(round(seconds * 1e6))))
+
+def label(name, func):
+    if func is None:
+        return name
+    return '{}({})'.format(name, func)
+
+class Phase(object):
+    __slots__ = ['profile', 'name', 'func']
+    def __init__(self, profile, name, func):
+        self.profile = profile
+        self.name = name
+        self.func = func
+
+    def __enter__(self):
+        self.profile.enter(self.name, self.func)
+
+    def __exit__(self, *exc_info):
+        self.profile.exit()
+
+# Stands in for the phase when profiling is off.
+class Disabled(object):
+    __slots__ = []
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+disabled = Disabled()
+
+# The hooks placed in the pipeline.
+def phase(name, func=None):
+    if active is None:
+        return disabled
+    return active.phase(name, function_name(func))
+
+def count(name, amount=1, func=None):
+    if active is not None:
+        active.count(name, amount, function_name(func))
+
+def function_name(func):
+    if func is None:
+        return None
+    return '{}.{}'.format(func.__module__, func.__name__)
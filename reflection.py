@@ -0,0 +1,193 @@
+import spirv
+
+# Configuring a pipeline needs just the entry points and the interface
+# of the shader. Everything interesting appears before the first
+# function, so we read only the opcode words up to there, and decode
+# the few instructions we actually look at.
+def reflect(data):
+    data, info = spirv.decode_header(data)
+    return Reflection(data)
+
+def reflect_file(fd):
+    return reflect(spirv.map_words(fd))
+
+op = dict((name, fmt['opcode']) for name, fmt in spirv.opname_table.items())
+result_word = dict((opcode, spirv.header_words[opcode])
+    for opcode, fmt in spirv.opcode_table.items() if fmt['result'])
+interesting = set(op[name] for name in [
+    'OpEntryPoint', 'OpExecutionMode', 'OpName', 'OpMemberName',
+    'OpDecorate', 'OpMemberDecorate', 'OpDecorationGroup', 'OpGroupDecorate',
+    'OpGroupMemberDecorate', 'OpVariable'])
+
+class Reflection(object):
+    def __init__(self, data):
+        self.data = data
+        self.ids = spirv.IdTable()
+        self.offsets = {}     # result id -> offset of the defining instruction
+        self.entry_points = []
+        self.variables = []
+        self.names = {}
+        self.member_names = {}
+        self.decorations = {}
+        self.member_decorations = {}
+        self.described = {}
+        found = dict((opcode, []) for opcode in interesting)
+        function = op['OpFunction']
+        start = 5
+        end = len(data)
+        while start < end:
+            word = data[start]
+            opcode = word & 0xFFFF
+            length = word >> 16
+            assert length != 0
+            if opcode == function:
+                break
+            if opcode in found:
+                found[opcode].append(start)
+            if opcode in result_word and result_word[opcode] < length:
+                self.offsets[data[start+result_word[opcode]]] = start
+            start += length
+        for instruction in self.decode_all(found[op['OpName']]):
+            self.names[instruction.args[0].result_id] = instruction.args[1]
+        for instruction in self.decode_all(found[op['OpMemberName']]):
+            target, member, name = instruction.args
+            self.member_names.setdefault(target.result_id, {})[member] = name
+        for instruction in self.decode_all(found[op['OpDecorate']]):
+            target, decoration, literals = instruction.args
+            self.decorations.setdefault(target.result_id, {})[decoration] = literals
+        for instruction in self.decode_all(found[op['OpMemberDecorate']]):
+            target, member, decoration, literals = instruction.args
+            members = self.member_decorations.setdefault(target.result_id, {})
+            members.setdefault(member, {})[decoration] = literals
+        # The decorations of a group go to each target it's applied to,
+        # and the group itself isn't kept.
+        applied = found[op['OpGroupDecorate']] + found[op['OpGroupMemberDecorate']]
+        for instruction in self.decode_all(sorted(applied)):
+            group, targets = instruction.args
+            for target in targets:
+                self.decorations.setdefault(target.result_id, {}).update(
+                    self.decorations.get(group.result_id, {}))
+                for member, decorations in self.member_decorations.get(group.result_id, {}).items():
+                    members = self.member_decorations.setdefault(target.result_id, {})
+                    members.setdefault(member, {}).update(decorations)
+        for start in found[op['OpDecorationGroup']]:
+            self.decorations.pop(data[start+1], None)
+            self.member_decorations.pop(data[start+1], None)
+        modes = {}
+        for instruction in self.decode_all(found[op['OpExecutionMode']]):
+            target, mode, literals = instruction.args
+            modes.setdefault(target.result_id, []).append((mode, literals))
+        for instruction in self.decode_all(found[op['OpEntryPoint']]):
+            model, function_id = instruction.args
+            self.entry_points.append(EntryPoint(model,
+                function_id.result_id,
+                self.names.get(function_id.result_id),
+                modes.get(function_id.result_id, [])))
+        for instruction in self.decode_all(found[op['OpVariable']]):
+            storage_class, initializer = instruction.args
+            pointer = self.describe(instruction.type_id)
+            self.variables.append(Variable(
+                instruction.result_id,
+                self.names.get(instruction.result_id),
+                storage_class,
+                pointer[2] if pointer[0] == 'pointer' else pointer,
+                self.decorations.get(instruction.result_id, {})))
+
+    def decode(self, start):
+        word = self.data[start]
+        return spirv.decode_instruction(word & 0xFFFF,
+            self.data[start+1:start+(word >> 16)], self.ids)
+
+    def decode_all(self, offsets):
+        for start in offsets:
+            instruction = self.decode(start)
+            if not isinstance(instruction, spirv.UnknownInstruction):
+                yield instruction
+
+    # Types are described as nested tuples, such as
+    # ('vector', ('float', 32), 4), so they are easy to compare.
+    def describe(self, type_id):
+        if type_id in self.described:
+            return self.described[type_id]
+        if type_id not in self.offsets:
+            return ('unknown', type_id)
+        instruction = self.decode(self.offsets[type_id])
+        if isinstance(instruction, spirv.UnknownInstruction):
+            return ('unknown', type_id)
+        name = instruction.name
+        args = instruction.args
+        if name == 'OpTypeVoid':
+            result = ('void',)
+        elif name == 'OpTypeBool':
+            result = ('bool',)
+        elif name == 'OpTypeInt':
+            result = ('int', args[0], bool(args[1]))
+        elif name == 'OpTypeFloat':
+            result = ('float', args[0])
+        elif name in ('OpTypeVector', 'OpTypeMatrix'):
+            result = (name[6:].lower(), self.describe(args[0].result_id), args[1])
+        elif name == 'OpTypeArray':
+            result = ('array', self.describe(args[0].result_id), self.constant(args[1].result_id))
+        elif name == 'OpTypeRuntimeArray':
+            result = ('runtime_array', self.describe(args[0].result_id))
+        elif name == 'OpTypeStruct':
+            result = ('struct', tuple(self.describe(member.result_id) for member in args[0]))
+        elif name == 'OpTypePointer':
+            result = ('pointer', args[0], self.describe(args[1].result_id))
+        elif name == 'OpTypeSampler':
+            result = ('sampler', self.describe(args[0].result_id), args[1]) + tuple(args[2:6])
+        else:
+            result = (name[6:].lower(),) + tuple(
+                arg.result_id if isinstance(arg, spirv.Id) else arg for arg in args)
+        self.described[type_id] = result
+        return result
+
+    def constant(self, result_id):
+        if result_id in self.offsets:
+            instruction = self.decode(self.offsets[result_id])
+            if getattr(instruction, 'name', None) == 'OpConstant' and len(instruction.args[0]) == 1:
+                return instruction.args[0][0]
+        return ('unknown', result_id)
+
+    def inputs(self):
+        return [var for var in self.variables if var.storage_class == 'Input']
+
+    def outputs(self):
+        return [var for var in self.variables if var.storage_class == 'Output']
+
+    # Resources bound through descriptor sets, by (set, binding).
+    def descriptors(self):
+        result = {}
+        for var in self.variables:
+            if 'DescriptorSet' in var.decorations or 'Binding' in var.decorations:
+                descriptor_set = var.decorations.get('DescriptorSet', [0])[0]
+                binding = var.decorations.get('Binding', [0])[0]
+                result[descriptor_set, binding] = var
+        return result
+
+class EntryPoint(object):
+    def __init__(self, model, function_id, name, modes):
+        self.model = model
+        self.function_id = function_id
+        self.name = name
+        self.modes = modes
+
+    def __repr__(self):
+        return "EntryPoint({}, {}, {!r}, {})".format(
+            self.model, self.function_id, self.name, self.modes)
+
+class Variable(object):
+    def __init__(self, result_id, name, storage_class, type, decorations):
+        self.result_id = result_id
+        self.name = name
+        self.storage_class = storage_class
+        self.type = type
+        self.decorations = decorations
+
+    @property
+    def location(self):
+        return self.decorations.get('Location', [None])[0]
+
+    def __repr__(self):
+        return "Variable({}, {!r}, {}, {}, {})".format(self.result_id,
+            self.name, self.storage_class, self.type, self.decorations)
@@ -1,6 +1,9 @@
 from array import array
-import json
+import hashlib
+import marshal
+import mmap
 import os
+import struct
 import sys
 import traceback
 
@@ -10,41 +13,106 @@ version = 99
 
 # Loads the file in module's directory
 basepath = os.path.dirname(__file__)
-with open(os.path.join(basepath,'spirv.json')) as fd:
-    tables = json.load(fd)
+tables_path = os.path.join(basepath, 'spirv.json')
+cache_path = tables_path + '.cache'
+
+# Every process that imports this module would parse spirv.json, so the
+# parsed tables are cached with marshal next to it. The cache is rebuilt
+# when its hash no longer matches the json, or the python version changes.
+# Returns the tables along with the hash of spirv.json.
+def load_tables():
+    with open(tables_path, 'rb') as fd:
+        source = fd.read()
+    digest = hashlib.sha1(source).hexdigest()
+    key = [sys.version, digest]
+    try:
+        with open(cache_path, 'rb') as fd:
+            cached_key, tables = marshal.load(fd)
+        if cached_key == key:
+            return tables, digest
+    except (IOError, EOFError, ValueError, TypeError):
+        pass
+    import json
+    tables = json.loads(source)
+    check_tables(tables)
+    # The cache is written under a temporary name first, so the processes
+    # starting at the same time never see a half written file.
+    temp_path = '{}.{}'.format(cache_path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as fd:
+            marshal.dump([key, tables], fd)
+        os.rename(temp_path, cache_path)
+    except (IOError, OSError):
+        pass # We may not have permission to write there.
+    return tables, digest
+
+# Some of the operands didn't match, so I'm running sanity check over
+# the instruction table to find out if there are more operands and 
+# constants that do not match. It runs only when the cache is rebuilt.
+def check_tables(tables):
+    for fmt in tables['instructions']:
+        for operand in fmt['operands']:
+            if operand not in ['LiteralNumber', 'LiteralString',
+                    'Id', 'VariableLiterals', 'VariableIds',
+                    'OptionalId', 'VariableLiteralId']:
+                assert (operand in tables['constants'] or
+                    operand in tables.get('masks', {})), (operand, fmt)
+
+tables, tables_digest = load_tables()
+
+# The reverse maps are only built for the constants that get decoded.
+class ReverseTable(dict):
+    def __missing__(self, name):
+        self[name] = table = dict((value, key)
+            for key, value in const_name_table[name].items())
+        return table
+
+    def __contains__(self, name):
+        return name in const_name_table
 
 const_name_table = tables['constants']
-const_table = {}
-for name, table in const_name_table.items():
-    const_table[name] = dict((value, key) for key, value in table.items())
+const_table = ReverseTable()
 bitmask_table = tables.get('masks', {})
 
 opcode_table = {}
 opname_table = {}
-# Some of the operands didn't match, so I'm running sanity check over
-# the instruction table to find out if there are more operands and 
-# constants that do not match.
 for fmt in tables['instructions']:
-    opcode_table[fmt['opcode']] = fmt # Also populating opcode and opname tables.
+    opcode_table[fmt['opcode']] = fmt
     opname_table[fmt['name']] = fmt
-    for operand in fmt['operands']:
-        if operand not in ['LiteralNumber', 'LiteralString',
-                'Id', 'VariableLiterals', 'VariableIds',
-                'OptionalId', 'VariableLiteralId']:
-            assert (operand in const_table or operand in bitmask_table), (operand, fmt)
+
+# Number of words taken by the type and result id.
+header_words = dict((opcode, fmt['type'] + fmt['result'])
+    for opcode, fmt in opcode_table.items())
 
 # IDs are annotated so you won't mix them with ordinary literals.
+# Decoded modules are large, so the instruction objects go without
+# a __dict__.
 class Id(object):
+    __slots__ = ['result_id']
     def __eq__(self, other): # Used this to check that the encoding/decoding matches.
         return self.result_id == other.result_id
 
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.result_id)
+
     def __init__(self, result_id):
-        self.result_id = result_id # Can switcheroo with the instruction at encoding.
+        self.result_id = result_id # Shared by every reference to the id, see IdTable.
 
     def __repr__(self):
         return "Id({})".format(self.result_id)
 
+# The decoder gives one Id object per result id in a module, so that
+# every reference to the same id doesn't allocate a new object.
+class IdTable(dict):
+    def __missing__(self, result_id):
+        self[result_id] = ident = Id(result_id)
+        return ident
+
 class Instruction(object):
+    __slots__ = ['name', 'type_id', 'result_id', 'args']
     def __init__(self, name, type_id=0, result_id=0, args=[]):
         self.name = name
         self.type_id = type_id
@@ -61,6 +129,7 @@ class Instruction(object):
 
 # If the instruction cannot be decoded, you get this instead.
 class UnknownInstruction(object):
+    __slots__ = ['opcode', 'data', 'traceback']
     def __init__(self, opcode, data, traceback):
         self.opcode = opcode
         self.data = data
@@ -72,82 +141,365 @@ class UnknownInstruction(object):
         return 'UnknownInstruction({!r})'.format(self.data)
 
 def decode_spirv(data):
-    if data[0] == magic_um: # If it was incompatible endian, we take
-        data.byteswap()     # a little penalty in swapping the bytes around.
+    data, info = decode_header(data)
+    # The instructions appear in a sequence, so I wouldn't
+    # necessarily need a complete decoder/encoder.
+    instructions = []
+    ids = IdTable()
+    start = 5
+    end = len(data)
+    while start < end:
+        word = data[start]
+        length = word >> 16
+        assert length != 0
+        instructions.append(decode_instruction(word & 0xFFFF, data[start+1:start+length], ids))
+        start += length
+    return instructions, info
+
+# Returns the words to decode, and the header info.
+def decode_header(data):
+    if data[0] == magic_um: # If it was incompatible endian, we take a little
+        data = WordView(data, swapped_order) # penalty in swapping every word we read.
     if data[0] != magic:
         raise Exception("not a SPIR-V file")
     if data[1] != version:
         raise Exception("version mismatch")
     assert data[4] == 0 # Reserved for an instruction schema
-    # The instructions appear in a sequence, so I wouldn't
-    # necessarily need a complete decoder/encoder.
-    instructions = []
+    return data, {
+        "bound":data[3], # 0 < id < bound
+        "generator_id":data[2]
+    }
+
+native_order = '<' if sys.byteorder == 'little' else '>'
+swapped_order = '>' if sys.byteorder == 'little' else '<'
+
+# Reads words from anything that exposes a buffer, such as an array or
+# a memory mapped file, in the given byte order. Indexing reads a single
+# word, slicing copies just the words that were asked for.
+class WordView(object):
+    def __init__(self, source, order=native_order):
+        self.source = source
+        self.buffer = buffer(source)
+        if len(self.buffer) % 4 != 0:
+            raise Exception("not a SPIR-V file, size is not a multiple of 4")
+        self.length = len(self.buffer) // 4
+        self.order = order
+        self.unpack_from = struct.Struct(order + 'I').unpack_from
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            assert step == 1
+            words = array('I', self.buffer[start*4:max(start, stop)*4])
+            if self.order != native_order:
+                words.byteswap()
+            return words
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        return self.unpack_from(self.buffer, index*4)[0]
+
+# Most of the time we only look at few sections of a big module, so
+# decoding everything up front is wasted work. The lazy module only
+# records where each instruction starts, and decodes an instruction
+# when it's accessed. Decoded instructions are kept, so changes made
+# into them are visible to the encoder.
+def decode_spirv_lazy(data):
+    data, info = decode_header(data)
+    offsets = array('I')
     start = 5
     while start < len(data):
-        opcode = data[start] & 0xFFFF
         length = data[start] >> 16
         assert length != 0
-        instructions.append(decode_instruction(opcode, data[start+1:start+length]))
+        offsets.append(start)
         start += length
-    return instructions, {
-        "bound":data[3], # 0 < id < bound
-        "generator_id":data[2]
-    }
+    assert start == len(data), "last instruction is truncated"
+    offsets.append(start)
+    return LazyModule(data, offsets), info
+
+class LazyModule(object):
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets # The last offset marks the end of the module.
+        self.decoded = {}
+        self.ids = IdTable()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        if index not in self.decoded:
+            start = self.offsets[index]
+            stop = self.offsets[index+1]
+            self.decoded[index] = decode_instruction(
+                self.data[start] & 0xFFFF, self.data[start+1:stop], self.ids)
+        return self.decoded[index]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    # Opcodes and lengths can be read without decoding anything.
+    def opcode(self, index):
+        return self.data[self.offsets[index]] & 0xFFFF
+
+    def words(self, index):
+        if index in self.decoded:
+            return encode_words(self.decoded[index])
+        return self.data[self.offsets[index]:self.offsets[index+1]]
+
+# Struct-of-arrays form of a module, for when many decoded modules need
+# to be held in memory. Opcodes, type and result ids are kept in their
+# own columns and the rest of the operand words in a shared pool.
+# Indexing decodes an Instruction from the columns every time, so
+# changes made into those instructions are not kept.
+def decode_spirv_packed(data):
+    data, info = decode_header(data)
+    return PackedModule(data), info
+
+class PackedModule(object):
+    def __init__(self, data):
+        self.opcodes = array('H')
+        self.type_ids = array('I')
+        self.result_ids = array('I')
+        self.starts = array('I') # Operands of i are in pool[starts[i]:starts[i+1]]
+        self.pool = array('I')
+        self.unsplit = set() # Instructions whose type and result stayed in the pool.
+        self.ids = IdTable()
+        start = 5
+        end = len(data)
+        while start < end:
+            word = data[start]
+            length = word >> 16
+            assert length != 0
+            opcode = word & 0xFFFF
+            head = header_words.get(opcode, 0)
+            if opcode not in opcode_table or length <= head:
+                self.unsplit.add(len(self.opcodes))
+                head = 0
+            fmt = opcode_table.get(opcode)
+            type_id = result_id = 0
+            if head > 0 and fmt['type']:
+                type_id = data[start+1]
+            if head > 0 and fmt['result']:
+                result_id = data[start+head]
+            self.opcodes.append(opcode)
+            self.type_ids.append(type_id)
+            self.result_ids.append(result_id)
+            self.starts.append(len(self.pool))
+            self.pool.extend(data[start+1+head:start+length])
+            start += length
+        assert start == end, "last instruction is truncated"
+        self.starts.append(len(self.pool))
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        opcode = self.opcodes[index]
+        return decode_instruction(opcode, self.operands(index), self.ids)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def opcode(self, index):
+        return self.opcodes[index]
+
+    # Operand words of the instruction, including type and result id.
+    def operands(self, index):
+        data = self.pool[self.starts[index]:self.starts[index+1]]
+        if index not in self.unsplit:
+            fmt = opcode_table[self.opcodes[index]]
+            if fmt['result']:
+                data.insert(0, self.result_ids[index])
+            if fmt['type']:
+                data.insert(0, self.type_ids[index])
+        return data
+
+    def words(self, index):
+        data = self.operands(index)
+        data.insert(0, len(data)+1 << 16 | self.opcodes[index])
+        return data
 
-def decode_instruction(opcode, data):
+def decode_instruction(opcode, data, ids=None):
     if opcode not in opcode_table:
         return UnknownInstruction(opcode, data, None)
+    if ids is None:
+        ids = IdTable()
+    decode = decoders[opcode]
     try:
-        fmt = opcode_table[opcode]
-        it = iter(data)
-        type_id = 0
-        if fmt['type']:
-            type_id = it.next()
-        result_id = 0
-        if fmt['result']:
-            result_id = it.next()
-        args = []
-        for operand in fmt['operands']:
-            if operand in const_table:
-                args.append(const_table[operand][it.next()])
-            elif operand in bitmask_table:
-                flag = it.next()
-                mask = set()
-                cover = 0
-                for name, value in bitmask_table[operand].items():
-                    if flag & value != 0:
-                        mask.add(name)
-                        cover |= value
-                if flag & ~cover != 0:
-                    mask.add(flag & ~cover)
-                args.append(mask)
-            elif operand == 'LiteralNumber':
-                args.append(it.next())
-            elif operand == 'LiteralString':
-                args.append(decode_literal_string(it))
-            elif operand == 'Id':
-                args.append(Id(it.next()))
+        return decode(data, ids)
+    except:
+        return UnknownInstruction(opcode, data, traceback.format_exc())
+
+# Interpreting the operand table for every instruction turned out to
+# be slow, so every opcode gets its own decoder and encoder, generated
+# from the table when the opcode is first seen. The operand dispatch is
+# resolved when the code is generated.
+class CodecTable(dict):
+    def __init__(self, generate):
+        dict.__init__(self)
+        self.generate = generate
+
+    def __missing__(self, opcode):
+        self[opcode] = codec = self.generate(opcode_table[opcode])
+        return codec
+
+def generate_decoder(fmt):
+    env = {'Instruction':Instruction, 'name':fmt['name'],
+        'decode_literal_string_at':decode_literal_string_at,
+        'decode_mask':decode_mask}
+    body = []
+    index = 0    # The position in data, while it is known.
+    fields = []
+    for field in ['type_id', 'result_id']:
+        if fmt[field.split('_')[0]]:
+            body.append("{} = data[{}]".format(field, index))
+            index += 1
+        else:
+            body.append("{} = 0".format(field))
+    # Once we pass a string, the position has to be tracked in 'i'.
+    at = lambda offset=0: "i+{}".format(offset) if index is None else str(index+offset)
+    for n, operand in enumerate(fmt['operands']):
+        arg = "a{}".format(n)
+        fields.append(arg)
+        if operand in const_table:
+            env['t{}'.format(n)] = const_table[operand]
+            body.append("{} = t{}[data[{}]]".format(arg, n, at()))
+        elif operand in bitmask_table:
+            env['t{}'.format(n)] = bitmask_table[operand].items()
+            body.append("{} = decode_mask(t{}, data[{}])".format(arg, n, at()))
+        elif operand == 'LiteralNumber':
+            body.append("{} = data[{}]".format(arg, at()))
+        elif operand == 'Id':
+            body.append("{} = ids[data[{}]]".format(arg, at()))
+        elif operand == 'LiteralString':
+            body.append("{}, i = decode_literal_string_at(data, {})".format(arg, at()))
+            index = None
+            continue
+        elif operand == 'VariableLiteralId':
+            body.append("rest = data[{}:]".format(at()))
+            body.append("if len(rest) % 2 != 0: raise Exception('literals and ids do not pair up')")
+            body.append("{} = [(rest[k], ids[rest[k+1]]) for k in range(0, len(rest), 2)]".format(arg))
+        elif operand == 'VariableLiterals':
+            body.append("{} = list(data[{}:])".format(arg, at()))
+        elif operand == 'VariableIds':
+            body.append("{} = [ids[word] for word in data[{}:]]".format(arg, at()))
+        elif operand == 'OptionalId':
+            body.append("rest = data[{}:]".format(at()))
+            body.append("if len(rest) > 1: raise Exception('too many operands')")
+            body.append("{} = ids[rest[0]] if len(rest) == 1 else None".format(arg))
+        else:
+            assert False, (operand, fmt)
+        if operand.startswith('Variable') or operand == 'OptionalId':
+            body.append("i = len(data)")
+            index = None
+        elif index is None:
+            body.append("i += 1")
+        else:
+            index += 1
+    body.append("if {} != len(data): raise Exception('operand count mismatch')".format(at()))
+    body.append("return Instruction(name, type_id, result_id, [{}])".format(', '.join(fields)))
+    return generate_function(fmt, 'decode', 'data, ids', body, env)
+
+def generate_encoder(fmt):
+    env = {'name':fmt['name'],
+        'encode_literal_string':encode_literal_string,
+        'encode_mask':encode_mask}
+    body = [
+        "args = instruction.args",
+        "if len(args) != {}: raise Exception('operand count mismatch')".format(len(fmt['operands'])),
+    ]
+    words = [] # Words that can be written out straight away.
+    if fmt['type']:
+        words.append("instruction.type_id")
+    if fmt['result']:
+        words.append("instruction.result_id")
+    body.append("data = [{}]".format(', '.join(words)))
+    words = []
+    def flush():
+        if len(words) > 0:
+            body.append("data.extend(({},))".format(', '.join(words)))
+            del words[:]
+    for n, operand in enumerate(fmt['operands']):
+        arg = "args[{}]".format(n)
+        if operand == 'LiteralNumber':
+            words.append(arg)
+        elif operand == 'Id':
+            words.append(arg + ".result_id")
+        elif operand in const_table:
+            env['t{}'.format(n)] = const_name_table[operand]
+            words.append("t{}[{}]".format(n, arg))
+        elif operand in bitmask_table:
+            env['t{}'.format(n)] = bitmask_table[operand]
+            words.append("encode_mask(t{}, {})".format(n, arg))
+        else:
+            flush()
+            if operand == 'LiteralString':
+                body.append("data.extend(encode_literal_string({}))".format(arg))
             elif operand == 'VariableLiteralId':
-                lit_ids = []
-                seq = list(it)         # Verify literals form pairs like
-                assert len(seq)%2 == 0 # they should.
-                it = iter(seq)
-                for literal in it:
-                    lit_ids.append((literal, Id(it.next())))
-                args.append(lit_ids)
+                body.append("for literal, item in {}:".format(arg))
+                body.append("    data.append(literal)")
+                body.append("    data.append(item.result_id)")
             elif operand == 'VariableLiterals':
-                args.append(list(it))
+                body.append("data.extend({})".format(arg))
             elif operand == 'VariableIds':
-                args.append(map(Id, it))
+                body.append("data.extend([item.result_id for item in {}])".format(arg))
             elif operand == 'OptionalId':
-                opt = map(Id, it)
-                assert len(opt) <= 1
-                args.append(None if len(opt) == 0 else opt[0])
-        assert len(fmt['operands']) == len(args)
-        assert tuple(it) == ()
-        return Instruction(fmt['name'], type_id, result_id, args)
-    except:
-        return UnknownInstruction(opcode, data, traceback.format_exc())
+                body.append("if {} is not None:".format(arg))
+                body.append("    data.append({}.result_id)".format(arg))
+            else:
+                assert False, (operand, fmt)
+    flush()
+    body.append("return data")
+    return generate_function(fmt, 'encode', 'instruction', body, env)
+
+def generate_function(fmt, kind, argument, body, env):
+    source = "def {}_{}({}):\n    {}\n".format(
+        kind, fmt['name'], argument, '\n    '.join(body))
+    code = compile(source, "<spirv {} {}>".format(kind, fmt['name']), 'exec')
+    exec code in env
+    return env['{}_{}'.format(kind, fmt['name'])]
+
+decoders = CodecTable(generate_decoder)
+encoders = CodecTable(generate_encoder)
+
+def decode_mask(masks, flag):
+    mask = set()
+    cover = 0
+    for name, value in masks:
+        if flag & value != 0:
+            mask.add(name)
+            cover |= value
+    if flag & ~cover != 0:
+        mask.add(flag & ~cover)
+    return mask
+
+def encode_mask(masks, mask):
+    flag = 0
+    for name in mask:
+        if isinstance(name, (int, long)): # Bits that had no name.
+            flag |= name
+        else:
+            flag |= masks[name]
+    return flag
 
 # Literal string parsing, as it appears in the SPIR-V specification
 def decode_literal_string(it):
@@ -162,60 +514,44 @@ def decode_literal_string(it):
             word >>= 8
     raise Exception("bad encoding")
 
+# Decodes a string starting from data[index], returns the string and
+# the index after it. The string ends at the first word whose highest
+# octet is zero.
+def decode_literal_string_at(data, index):
+    end = index
+    while data[end] & 0xFF000000 != 0:
+        end += 1
+    return decode_literal_string(data[index:end+1]), end+1
+
 def encode_spirv(instructions, bound, generator_id=0, schema_id=0):
     result = [magic, version, generator_id, bound, schema_id]
+    # Instructions that were never decoded are copied over as they are,
+    # packed modules are written from their columns.
+    if isinstance(instructions, (LazyModule, PackedModule)):
+        for index in range(len(instructions)):
+            result.extend(instructions.words(index))
+        return result
     for instruction in instructions:
-        if isinstance(instruction, UnknownInstruction):
-            opcode = instruction.opcode
-            data = instruction.data
-        elif instruction.name not in opname_table:
-            raise Exception("cannot encode {}, unknown opname".format(instruction))
-        else:
-            fmt = opname_table[instruction.name]
-            opcode = fmt['opcode']
-            data = list(encode_instruction(fmt, instruction))
-        assert len(data) <= 0xFFFF
-        result.append(len(data)+1 << 16 | opcode & 0xFFFF)
-        result.extend(data)
+        result.extend(encode_words(instruction))
     return result
 
+# Encodes a single instruction, including the opcode/length word.
+def encode_words(instruction):
+    if isinstance(instruction, UnknownInstruction):
+        opcode = instruction.opcode
+        data = list(instruction.data)
+    elif instruction.name not in opname_table:
+        raise Exception("cannot encode {}, unknown opname".format(instruction))
+    else:
+        fmt = opname_table[instruction.name]
+        opcode = fmt['opcode']
+        data = encode_instruction(fmt, instruction)
+    assert len(data) < 0xFFFF
+    data.insert(0, len(data)+1 << 16 | opcode & 0xFFFF)
+    return data
+
 def encode_instruction(fmt, instruction):
-    if fmt['type']:
-        yield instruction.type_id
-    if fmt['result']:
-        yield instruction.result_id
-    assert len(fmt['operands']) == len(instruction.args)
-    for operand, field in zip(fmt['operands'], instruction.args):
-        if operand == 'LiteralNumber':
-            yield field
-        elif operand == 'LiteralString':
-            for data in encode_literal_string(field):
-                yield data
-        elif operand == 'Id':
-            yield field.result_id
-        elif operand == 'VariableLiteralId':
-            for literal, item in field:
-                yield literal
-                yield item.result_id
-        elif operand == 'VariableLiterals':
-            for literal in field:
-                yield literal
-        elif operand == 'VariableIds':
-            for item in field:
-                yield item.result_id
-        elif operand == 'OptionalId':
-            if field is not None:
-                yield field.result_id
-        elif operand in const_table:
-            yield const_name_table[operand][field]
-        elif operand in bitmask_table:
-            masks = bitmask_table[operand]
-            flag = 0
-            for name in field:
-                flag |= masks[name]
-            yield flag
-        else:
-            assert False, (operand, instructions)
+    return encoders[fmt['opcode']](instruction)
 
 def encode_literal_string(string):
     string = string.encode('utf-8') + '\x00'
@@ -225,12 +561,401 @@ def encode_literal_string(string):
             word = word << 8 | ord(ch)
         yield word
 
+# The order in which instructions appear in a module. The names
+# that are missing from our spirv.json are just never matched.
+layout_sections = [
+    ('source', ['OpSource', 'OpSourceExtension']),
+    ('capabilities', ['OpCapability', 'OpCompileFlag']),
+    ('extensions', ['OpExtension', 'OpExtInstImport']),
+    ('memory_model', ['OpMemoryModel']),
+    ('entry_points', ['OpEntryPoint']),
+    ('execution_modes', ['OpExecutionMode']),
+    ('debug', ['OpString', 'OpName', 'OpMemberName']),
+    ('annotations', ['OpDecorate', 'OpMemberDecorate', 'OpGroupDecorate',
+        'OpGroupMemberDecorate', 'OpDecorationGroup']),
+    ('globals', [fmt['name'] for fmt in tables['instructions']
+        if fmt['name'].startswith(('OpType', 'OpConstant', 'OpSpecConstant'))]
+        + ['OpVariable', 'OpVariableArray']),
+    ('functions', ['OpFunction']),
+]
+section_table = dict((name, section)
+    for section, names in layout_sections for name in names)
+
+# Analysis keeps asking what defines an id, or what decorates it, so
+# these are collected in one pass over the module. Instructions that
+# may appear anywhere, such as OpLine, go to the section they appear in,
+# and everything after the first OpFunction goes to functions.
+class ModuleIndex(object):
+    def __init__(self, instructions):
+        self.definitions = {}  # result id -> instruction
+        self.by_opcode = {}    # opname (or opcode if unknown) -> instructions
+        self.decorations = {}  # target id -> decorations
+        self.names = {}        # target id -> OpName and OpMemberName
+        self.sections = dict((section, []) for section, _ in layout_sections)
+        section = 'source'
+        for instruction in instructions:
+            if isinstance(instruction, UnknownInstruction):
+                self.by_opcode.setdefault(instruction.opcode, []).append(instruction)
+                self.sections[section].append(instruction)
+                continue
+            name = instruction.name
+            self.by_opcode.setdefault(name, []).append(instruction)
+            if section != 'functions':
+                section = section_table.get(name, section)
+            self.sections[section].append(instruction)
+            if instruction.result_id != 0:
+                self.definitions[instruction.result_id] = instruction
+            if name in ('OpDecorate', 'OpMemberDecorate'):
+                target = instruction.args[0].result_id
+                self.decorations.setdefault(target, []).append(instruction)
+            elif name in ('OpGroupDecorate', 'OpGroupMemberDecorate'):
+                group = self.decorations.get(instruction.args[0].result_id, [])
+                for target in instruction.args[1]:
+                    self.decorations.setdefault(target.result_id, []).extend(group)
+            elif name in ('OpName', 'OpMemberName'):
+                target = instruction.args[0].result_id
+                self.names.setdefault(target, []).append(instruction)
+
+    def __getitem__(self, result_id):
+        return self.definitions[result_id]
+
+    def get(self, opname):
+        return self.by_opcode.get(opname, [])
+
+    def name(self, result_id):
+        for instruction in self.names.get(result_id, []):
+            if instruction.name == 'OpName':
+                return instruction.args[1]
+
+    # Returns the literals of the decoration, or None if it's not there.
+    def decoration(self, result_id, decoration):
+        for instruction in self.decorations.get(result_id, []):
+            if instruction.name == 'OpDecorate' and instruction.args[1] == decoration:
+                return instruction.args[2]
+
+# Gives the same hash for modules that differ only in how their ids are
+# numbered, or in the order of the instructions within their sections.
+# Works on decoded, lazy and packed modules alike, in one pass over the
+# words.
+#
+# Globals are defined before they're used, so each one is identified by
+# a digest of its opcode, its literals and the digests of the ids it
+# refers to, taken as it comes by. The names and decorations of the id
+# come before the globals, so they go into the digest too, and so does
+# the count of globals seen with the same digest, which keeps identical
+# globals apart. A function is identified in the same way once its
+# OpFunctionEnd is reached, from its body with its own ids numbered in
+# the order they appear. Calls may go to functions further down, so the
+# callees are hashed in at the end, along with the entry points, names
+# and decorations. Decoration groups are hashed as the decorations they
+# apply.
+#
+# The digests of the functions and of everything outside them are
+# sorted before they go into the hash, so their order doesn't matter,
+# but repeats do. Instructions that didn't decode, or are too short for
+# their opcode, are hashed as they are.
+def canonical_hash(instructions):
+    if isinstance(instructions, (LazyModule, PackedModule)):
+        stream = ((instructions.words(index), True) for index in range(len(instructions)))
+    else:
+        stream = ((encode_words(instruction), not isinstance(instruction, UnknownInstruction))
+            for instruction in instructions)
+    canonical = CanonicalHash()
+    for words, decoded in stream:
+        canonical.feed(array('I', words), decoded)
+    return canonical.finish()
+
+class CanonicalHash(object):
+    def __init__(self):
+        self.globals = {}     # id defined outside functions -> digest
+        self.locals = {}      # id of a function, or defined in one -> digest
+        self.forwards = {}    # id used before its definition -> order of use
+        self.attached = None  # id -> digests of its names and decorations
+        self.seen = {}        # digest -> count of definitions with it
+        self.digests = []     # of the functions and everything outside them
+        self.deferred = []    # entry points, names and decorations
+        self.functions = []   # (digest, ids called)
+        self.body = None      # (words, positions) of the function being read
+
+    def feed(self, words, decoded):
+        positions = locate(words) if decoded else None
+        if self.body is not None:
+            self.body.append((words, positions))
+            if words[0] & 0xFFFF == function_end_opcode:
+                self.end_function()
+            return
+        if positions is None:
+            self.digests.append(hashlib.sha1(words.tostring()).digest())
+            return
+        opcode = words[0] & 0xFFFF
+        section = section_table.get(opcode_table[opcode]['name'])
+        if section in deferred_sections and opcode != string_opcode:
+            self.deferred.append(words)
+            return
+        if self.attached is None and section not in early_sections:
+            self.attach()
+        if section == 'functions':
+            self.body = [(words, positions)]
+            return
+        result = result_positions[opcode]
+        result_id = words[result] if result != 0 else None
+        digest = hashlib.sha1(substitute(words, positions, result, self.global_token)).digest()
+        if result_id is not None:
+            digest = self.identify(digest, result_id)
+            self.globals[result_id] = digest
+        self.digests.append(digest)
+
+    def global_token(self, result_id):
+        if result_id in self.globals:
+            return 'G' + self.globals[result_id]
+        return 'F' + struct.pack('<I', self.forwards.setdefault(result_id, len(self.forwards)))
+
+    # The names and decorations, without their targets, by target.
+    def attach(self):
+        self.attached = {}
+        for words in expand_groups(self.deferred):
+            if words[0] & 0xFFFF in attachable_opcodes:
+                target = words[1]
+                words[1] = 0
+                self.attached.setdefault(target, []).append(hashlib.sha1(words.tostring()).digest())
+                words[1] = target
+
+    def identify(self, digest, result_id):
+        extra = (self.attached or {}).get(result_id)
+        if extra:
+            digest = hashlib.sha1(digest + ''.join(sorted(extra))).digest()
+        count = self.seen.get(digest, 0)
+        self.seen[digest] = count + 1
+        if count == 0:
+            return digest
+        return hashlib.sha1(digest + struct.pack('<I', count)).digest()
+
+    def end_function(self):
+        body, self.body = self.body, None
+        defined = set(words[result_positions[words[0] & 0xFFFF]]
+            for words, positions in body
+            if positions is not None and result_positions[words[0] & 0xFFFF] != 0)
+        numbers = {}
+        called = []
+        def token(result_id):
+            if result_id in defined:
+                return 'L' + struct.pack('<I', numbers.setdefault(result_id, len(numbers) + 1))
+            if result_id in self.globals:
+                return 'G' + self.globals[result_id]
+            called.append(result_id)
+            return 'X'
+        words, positions = body[0]
+        function_id = words[2] if positions is not None else None
+        shape = hashlib.sha1()
+        for words, positions in body:
+            if positions is None:
+                shape.update('R' + words.tostring())
+            else:
+                shape.update('I' + substitute(words, positions, None, token))
+        identity = self.identify(shape.digest(), function_id)
+        self.functions.append((identity, called))
+        for result_id, number in numbers.items():
+            self.locals[result_id] = hashlib.sha1(identity + struct.pack('<I', number)).digest()
+        if function_id is not None:
+            self.locals[function_id] = identity
+
+    def lookup(self, result_id):
+        if result_id in self.globals:
+            return self.globals[result_id]
+        if result_id in self.locals:
+            return self.locals[result_id]
+        return hashlib.sha1('undefined {}'.format(result_id)).digest()
+
+    def finish(self):
+        if self.body is not None:
+            self.end_function()
+        token = lambda result_id: 'G' + self.lookup(result_id)
+        for identity, called in self.functions:
+            self.digests.append(hashlib.sha1(identity + ''.join(map(self.lookup, called))).digest())
+        for words in expand_groups(self.deferred):
+            positions = locators[words[0] & 0xFFFF](words)
+            self.digests.append(hashlib.sha1(substitute(words, positions, None, token)).digest())
+        digest = hashlib.sha1()
+        for item in sorted(self.digests):
+            digest.update(item)
+        # Where the forward references went.
+        for result_id, order in sorted(self.forwards.items(), key=lambda item: item[1]):
+            digest.update(self.lookup(result_id))
+        return digest.hexdigest()
+
+# The positions of the ids in the words, or None if the words are too
+# short for them, or the opcode is unknown.
+def locate(words):
+    opcode = words[0] & 0xFFFF
+    if opcode not in opcode_table:
+        return None
+    try:
+        positions = locators[opcode](words)
+    except IndexError:
+        return None
+    if len(positions) > 0 and positions[-1] >= len(words):
+        return None
+    return positions
+
+# The words with the ids zeroed, followed by the tokens given to them,
+# except for the one at the position skipped. The words are zeroed in
+# place, as each instruction is substituted once.
+def substitute(words, positions, skip, token):
+    tokens = []
+    for position in positions:
+        if position != skip:
+            tokens.append(token(words[position]))
+        words[position] = 0
+    return words.tostring() + ''.join(tokens)
+
+early_sections = set(['source', 'capabilities', 'extensions', 'memory_model',
+    'entry_points', 'execution_modes', 'debug', 'annotations'])
+deferred_sections = set(['entry_points', 'execution_modes', 'debug', 'annotations'])
+attachable_opcodes = set(opname_table[name]['opcode']
+    for name in ('OpName', 'OpMemberName', 'OpDecorate', 'OpMemberDecorate'))
+string_opcode = opname_table['OpString']['opcode']
+function_end_opcode = opname_table['OpFunctionEnd']['opcode']
+result_positions = dict((fmt['opcode'], (2 if fmt['type'] else 1) if fmt['result'] else 0)
+    for fmt in tables['instructions'])
+
+# Replaces the group decorations with copies of the decorations of the
+# group, one per target.
+def expand_groups(unordered):
+    group_opcode = opname_table['OpDecorationGroup']['opcode']
+    decorate_opcodes = set(opname_table[name]['opcode']
+        for name in ('OpDecorate', 'OpMemberDecorate'))
+    apply_opcodes = set(opname_table[name]['opcode']
+        for name in ('OpGroupDecorate', 'OpGroupMemberDecorate'))
+    groups = dict((words[1], []) for words in unordered
+        if words[0] & 0xFFFF == group_opcode)
+    result = []
+    for words in unordered:
+        opcode = words[0] & 0xFFFF
+        if opcode in decorate_opcodes and words[1] in groups:
+            groups[words[1]].append(words)
+        elif opcode != group_opcode and opcode not in apply_opcodes:
+            result.append(words)
+    for words in unordered:
+        if words[0] & 0xFFFF in apply_opcodes:
+            for target in words[2:]:
+                for decoration in groups.get(words[1], []):
+                    decoration = array('I', decoration)
+                    decoration[1] = target
+                    result.append(decoration)
+    return result
+
+# The positions of the ids in the words of an instruction, result id
+# and type included. Generated per opcode like the codecs.
+def generate_locator(fmt):
+    body = ["positions = []"]
+    index = 1
+    for field in ['type', 'result']:
+        if fmt[field]:
+            body.append("positions.append({})".format(index))
+            index += 1
+    at = lambda: "i" if index is None else str(index)
+    for operand in fmt['operands']:
+        if operand == 'Id':
+            body.append("positions.append({})".format(at()))
+        elif operand == 'OptionalId':
+            body.append("if {} < len(words): positions.append({})".format(at(), at()))
+        elif operand == 'VariableIds':
+            body.append("positions.extend(range({}, len(words)))".format(at()))
+        elif operand == 'VariableLiteralId':
+            body.append("positions.extend(range({}+1, len(words), 2))".format(at()))
+        elif operand == 'LiteralString':
+            body.append("i = {}".format(at()))
+            body.append("while words[i] & 0xFF000000 != 0: i += 1")
+            body.append("i += 1")
+            index = None
+            continue
+        if operand.startswith('Variable') or operand == 'OptionalId':
+            body.append("i = len(words)")
+            index = None
+        elif index is None:
+            body.append("i += 1")
+        else:
+            index += 1
+    body.append("return positions")
+    return generate_function(fmt, 'locate', 'words', body, {})
+
+locators = CodecTable(generate_locator)
+
 def load(fd):
     return decode_spirv(array('I', fd.read()))
 
+# Maps the file into memory and reads the words straight from the
+# mapping, so the file is never copied as a whole. The byte order is
+# picked from the magic number. Returns a LazyModule unless told otherwise.
+def load_mapped(fd, lazy=True):
+    data = map_words(fd)
+    if lazy:
+        return decode_spirv_lazy(data)
+    return decode_spirv(data)
+
+def map_words(fd):
+    mapping = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(mapping) < 20:
+        raise Exception("not a SPIR-V file")
+    if struct.unpack_from('<I', mapping)[0] == magic:
+        return WordView(mapping, '<')
+    return WordView(mapping, '>')
+
 def stringify_spirv(data):
     return array('I', data).tostring()
 
+# Writes a module into a file in fixed size chunks, so that the whole
+# module never has to be in memory. If the bound isn't known up front,
+# it's computed from the result ids and patched into the header when
+# the writer is closed. That requires the file to be seekable.
+class Writer(object):
+    def __init__(self, fd, bound=None, generator_id=0, schema_id=0, chunk_size=16384):
+        self.fd = fd
+        self.bound = bound
+        self.chunk_size = chunk_size
+        self.chunk = array('I', [magic, version, generator_id, bound or 0, schema_id])
+        self.start = fd.tell() if bound is None else None
+        self.max_id = 0
+
+    def write(self, instruction):
+        self.write_words(encode_words(instruction))
+
+    # The words must form a complete instruction, with the opcode word.
+    def write_words(self, words):
+        if self.bound is None:
+            fmt = opcode_table.get(words[0] & 0xFFFF)
+            position = header_words.get(words[0] & 0xFFFF)
+            if fmt is not None and fmt['result'] and position < len(words):
+                self.max_id = max(self.max_id, words[position])
+        self.chunk.extend(words)
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        self.fd.write(self.chunk.tostring())
+        del self.chunk[:]
+
+    # Returns the bound that ended up into the header.
+    def close(self):
+        self.flush()
+        if self.bound is None:
+            self.bound = self.max_id + 1
+            end = self.fd.tell()
+            self.fd.seek(self.start + 12)
+            self.fd.write(array('I', [self.bound]).tostring())
+            self.fd.seek(end)
+        return self.bound
+
+def write_spirv(fd, instructions, bound=None, generator_id=0, schema_id=0):
+    writer = Writer(fd, bound, generator_id, schema_id)
+    if isinstance(instructions, (LazyModule, PackedModule)):
+        for index in range(len(instructions)):
+            writer.write_words(instructions.words(index))
+    else:
+        for instruction in instructions:
+            writer.write(instruction)
+    return writer.close()
+
 if __name__=='__main__':
     instructions, info = load(open(sys.argv[1], 'rb'))
     instructions_, info_ = decode_spirv(encode_spirv(instructions, **info))
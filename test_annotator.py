@@ -0,0 +1,65 @@
+from annotator import *
+import gc
+import math
+import annotator
+import discovery
+import translate
+
+def loop(x, y, z):
+    while x:
+        y = 10
+        if True:
+            z = 20
+    return z
+
+def constant(x):
+    return 5
+
+def test_annotate():
+    unit = translate.TranslationUnit()
+    proc = unit.build_function(FuncType(t_int, [t_bool, t_int, t_int]), loop)
+    unit.annotator.run()
+    for value in proc.values():
+        if isinstance(value, discovery.Phi):
+            assert value.annotation is t_int
+    assert proc.annotation.restype is t_int
+    # Every value and the global 'True' is annotated once, and the
+    # changes reschedule only the users.
+    count = sum(1 for value in proc.values()) + 1
+    assert unit.annotator.iterations == count + unit.annotator.requeues
+
+def test_constant():
+    unit = translate.TranslationUnit()
+    proc = unit.build_function(FuncType(None, [t_int]), constant)
+    unit.annotator.run()
+    assert proc.annotation.restype is Constant(t_int, 5)
+
+def test_signed_zero():
+    zero, negative = Constant(t_float, 0.0), Constant(t_float, -0.0)
+    assert zero is not negative
+    assert math.copysign(1, negative.value) == -1
+    assert Constant(t_float, -0.0) is negative
+    assert union(zero, negative) is t_float
+    assert Constant(t_float, float('nan')) is Constant(t_float, float('nan'))
+
+def test_memory():
+    Constant(t_int, 123456789).value
+    FuncType(Constant(t_int, 987654321), [t_int]).restype
+    gc.collect()
+    assert not any(key[2] in (123456789, 987654321) for key in Constant.instances.keys())
+    size = annotator.union_cache_size
+    try:
+        annotator.union_cache_size = 4
+        values = [Constant(t_int, i) for i in range(10)]
+        for value in values:
+            assert union(value, t_bool) is t_int
+            assert len(union_cache) <= 4
+    finally:
+        annotator.union_cache_size = size
+
+if __name__=='__main__':
+    test_annotate()
+    test_constant()
+    test_signed_zero()
+    test_memory()
+    print 'ok'
@@ -0,0 +1,83 @@
+from array import array
+from StringIO import StringIO
+from spirv import *
+from test_spirv import sample_module
+import assembly
+
+def sample_words():
+    instructions = sample_module()
+    instructions.insert(6, Instruction('OpName', 0, 0, [Id(5), u'v\xe4ri "x"']))
+    instructions.insert(7, Instruction('OpName', 0, 0, [Id(11), u'main']))
+    instructions.append(UnknownInstruction(0x7FFF, [1, 2, 3], None))
+    return encode_spirv(instructions, 12)
+
+def disassemble(words, names=True):
+    text = StringIO()
+    assembly.disassemble(array('I', words), text, names)
+    return text.getvalue()
+
+def assemble(text):
+    output = StringIO()
+    bound = assembly.assemble(StringIO(text), output)
+    words = array('I')
+    words.fromstring(output.getvalue())
+    assert words[3] == bound
+    return words
+
+def test_disassemble():
+    text = disassemble(sample_words())
+    assert '; Bound: 12\n' in text
+    assert '%main = OpFunction %2 DontInline %3\n' in text
+    assert 'OpEntryPoint Fragment %main\n' in text
+    # The second name given to main goes unused.
+    assert '%11 = OpConstantComposite %7 %10 %10 %10 %10\n' in text
+    assert 'OpName %v__ri__x_ "v\xc3\xa4ri \\"x\\""\n' in text
+    assert 'OpSwitch %10 %v__ri__x_ 1 %v__ri__x_ 2 %v__ri__x_\n' in text
+    assert 'OpUnknown 32767 1 2 3\n' in text
+
+def test_roundtrip():
+    words = sample_words()
+    assert list(assemble(disassemble(words, names=False))) == words
+    # The named ids are numbered from the bound.
+    words_ = assemble(disassemble(words))
+    assert words_[3] == 15
+    assert canonical_hash(decode_spirv(words_)[0]) == canonical_hash(decode_spirv(array('I', words))[0])
+
+def test_errors():
+    for text, message in [
+            ('OpFoo %1\n', 'line 1: unknown instruction OpFoo'),
+            ('%1 = OpTypeFloat 32 1\n', 'line 1: too many operands for OpTypeFloat'),
+            ('\nOpEntryPoint Nowhere %1\n', 'line 2: Nowhere is not in ExecutionModel'),
+            ('OpTypeVoid\n', 'line 1: OpTypeVoid needs a result')]:
+        try:
+            assemble(text)
+        except Exception as error:
+            assert str(error) == message, error
+        else:
+            assert False, text
+
+def test_numbered_then_named():
+    words = assemble('%1 = OpTypeVoid\n%foo = OpTypeBool\n%3 = OpTypeFunction %foo\n%bar = OpTypeFloat 32\n')
+    instructions = decode_spirv(words)[0]
+    assert [instruction.result_id for instruction in instructions] == [1, 2, 3, 4]
+    assert words[3] == 5
+    try:
+        assemble('%foo = OpTypeVoid\n%1 = OpTypeBool\n')
+    except Exception as error:
+        assert str(error) == 'line 2: %1 is taken by a named id, the bound in the header is too small', error
+    else:
+        assert False
+
+def test_strings():
+    string = u'a\nb\tc\r\x01\x1b\x7f\\x41 "\xe4"'
+    text = disassemble(encode_spirv([Instruction('OpString', 0, 1, [string])], 2))
+    assert 'OpString "a\\nb\\tc\\r\\x01\\x1b\\x7f\\\\x41 \\"\xc3\xa4\\""\n' in text
+    assert decode_spirv(assemble(text))[0][0].args == [string]
+
+if __name__=='__main__':
+    test_disassemble()
+    test_roundtrip()
+    test_errors()
+    test_numbered_then_named()
+    test_strings()
+    print 'ok'
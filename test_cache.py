@@ -0,0 +1,86 @@
+from annotator import *
+import os
+import shutil
+import tempfile
+import time
+import cache
+import discovery
+import translate
+
+def constant(x):
+    return 5
+
+def test_get_put():
+    path = tempfile.mkdtemp()
+    try:
+        disk = cache.DiskCache(path)
+        assert disk.get('abcdef') is None
+        disk.put('abcdef', 'data')
+        assert disk.get('abcdef') == 'data'
+        assert os.path.exists(os.path.join(path, 'ab', 'cdef'))
+        assert (disk.hits, disk.misses) == (1, 1)
+    finally:
+        shutil.rmtree(path)
+
+def test_evict():
+    path = tempfile.mkdtemp()
+    try:
+        disk = cache.DiskCache(path)
+        now = time.time()
+        for n, key in enumerate(['aa01', 'aa02', 'aa03']):
+            disk.put(key, 'x' * 100)
+            os.utime(disk.entry_path(key), (now - 100 + n, now - 100 + n))
+        # Reading an entry makes it the most recently used one.
+        disk.get('aa01')
+        stale = os.path.join(path, 'aa', '.tmpstale')
+        fresh = os.path.join(path, 'aa', '.tmpfresh')
+        for temp in (stale, fresh):
+            with open(temp, 'wb') as fd:
+                fd.write('x')
+        os.utime(stale, (now - 7200, now - 7200))
+        disk.max_size = 250
+        disk.evict()
+        assert disk.get('aa02') is None
+        assert disk.get('aa03') is not None
+        assert disk.get('aa01') is not None
+        assert not os.path.exists(stale)
+        assert os.path.exists(fresh)
+    finally:
+        shutil.rmtree(path)
+
+def test_unit_hit():
+    path = tempfile.mkdtemp()
+    read = discovery.read
+    try:
+        functype = FuncType(None, [t_int])
+        unit = translate.TranslationUnit(cache=cache.DiskCache(path))
+        unit.build_function(functype, constant)
+        unit.annotator.run()
+        unit.translate()
+        # The second unit must not discover the function again.
+        def fail(func):
+            assert False, func
+        discovery.read = fail
+        unit = translate.TranslationUnit(cache=cache.DiskCache(path))
+        proc = unit.build_function(functype, constant)
+        assert isinstance(proc, translate.Cached)
+        assert unit.cache.hits == 1
+    finally:
+        discovery.read = read
+        shutil.rmtree(path)
+
+def test_key_covers_helpers():
+    namespace = {}
+    exec "def helper(x):\n    return x + 1\ndef caller(x):\n    return helper(x)\n" in namespace
+    functype = FuncType(t_int, [t_int])
+    key = translate.cache_key(namespace['caller'], functype)
+    assert translate.cache_key(namespace['caller'], functype) == key
+    exec "def helper(x):\n    return x + 2\n" in namespace
+    assert translate.cache_key(namespace['caller'], functype) != key
+
+if __name__=='__main__':
+    test_get_put()
+    test_evict()
+    test_unit_hit()
+    test_key_covers_helpers()
+    print 'ok'
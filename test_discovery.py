@@ -1,3 +1,7 @@
+from dis import findlinestarts
+import opcode
+import sys
+import types
 import discovery
 
 def hello(x, y, z):
@@ -17,4 +21,160 @@ def hello2(x, a, b):
         x = 10
     return x
 
-print discovery.read(hello)
+# Every variable is written in the loop, but t isn't live at the top of
+# it, so pruned SSA gives it no phi-node there.
+def dead_in_loop(x, n, t):
+    while n:
+        t = x
+        x = n
+        n = t
+    return x
+
+# On the first time around b is read before it's assigned.
+def maybe_assigned(a):
+    if a:
+        b = 1
+    return b
+
+def swap(a, b, n):
+    while n:
+        a, b = b, a
+        n = a
+    return b
+
+def rotate(a, b, c, n):
+    while n:
+        a, b, c = c, a, b
+    return a
+
+def swapped(a, b):
+    a, b = b, a
+    return a
+
+def rotated(a, b, c):
+    a, b, c = c, a, b
+    return b
+
+# Blocks connected by hand, edges given as (from, to).
+def flow_graph(count, edges):
+    proc = discovery.Procedure(None)
+    blocks = [proc.new_block() for i in range(count)]
+    for a, b in edges:
+        blocks[a].succ.append(blocks[b])
+        blocks[b].prec.append(blocks[a])
+    return blocks
+
+def test_dominators():
+    # A diamond from 0 to 3, then a loop with 4 as its header.
+    blocks = flow_graph(7, [(0, 1), (0, 2), (1, 3), (2, 3), (3, 4), (4, 5), (5, 4), (4, 6)])
+    tree = discovery.DominatorTree(blocks[0])
+    index = lambda block: block and block.index
+    assert [index(tree.idom[block]) for block in blocks] == [None, 0, 0, 0, 3, 4, 4]
+    assert [tree.depth[block] for block in blocks] == [0, 1, 1, 1, 2, 3, 3]
+    assert [map(index, tree.frontiers[block]) for block in blocks] == [
+        [], [3], [3], [], [4], [4], []]
+    assert tree.dominates(blocks[3], blocks[6])
+    assert tree.dominates(blocks[4], blocks[4])
+    assert not tree.dominates(blocks[1], blocks[3])
+    assert not tree.dominates(blocks[5], blocks[6])
+    preorder = map(index, tree.preorder())
+    assert sorted(preorder) == range(7)
+    assert all(preorder.index(index(tree.idom[block])) < preorder.index(block.index)
+        for block in blocks[1:])
+    assert sorted(map(index, tree.children[blocks[4]])) == [5, 6]
+
+def phis(func):
+    proc = discovery.read(func)
+    return sorted((block.index, variable.name)
+        for block in proc.blocks for variable in block.phi)
+
+def test_phis():
+    assert phis(hello) == [(1, 'z'), (3, 'z'), (4, 'z')]
+    assert phis(hello2) == [(4, 'x')]
+    assert phis(dead_in_loop) == [(1, 'n'), (1, 'x'), (3, 'x')]
+
+def test_undefined():
+    try:
+        discovery.read(maybe_assigned)
+    except Exception as error:
+        assert str(error).startswith("Variable 'b' may be used before it is assigned.")
+        # The line of the branch that skips the assignment.
+        line = maybe_assigned.func_code.co_firstlineno + 1
+        assert str(error).endswith("line {}".format(line))
+    else:
+        assert False
+
+# The values swapped in the loop are the ones coming in to the header.
+def test_swap():
+    for func, expect in [(swap, {'a':'b', 'b':'a'}), (rotate, {'a':'c', 'b':'a', 'c':'b'})]:
+        proc = discovery.read(func)
+        header = [block for block in proc.blocks if len(block.phi) > 0][0]
+        loop = [prec for prec in header.prec if prec is not proc.blocks[0]][0]
+        phis = dict((variable.name, phi) for variable, phi in header.phi.items())
+        for name, source in expect.items():
+            assert phis[name].args[loop] is phis[source], (func, name)
+            assert phis[name].args[proc.blocks[0]] is proc.arguments[
+                func.func_code.co_varnames.index(name)]
+
+# ROT_TWO and ROT_THREE move the values on the stack, and nothing else.
+def test_rotations():
+    for func, index in [(swapped, 1), (rotated, 0)]:
+        assert set(['ROT_TWO', 'ROT_THREE']) & set(opcode.opname[op]
+            for op in discovery.Bytecode(func.func_code).opcodes)
+        proc = discovery.read(func)
+        block, = proc.blocks
+        ret, = block.instructions
+        assert ret.name == 'return'
+        assert ret.args == [proc.arguments[index]], func
+
+def test_extended_arg():
+    code_string = ''.join(map(chr, [
+        opcode.EXTENDED_ARG, 1, 0,
+        opcode.opmap['LOAD_CONST'], 2, 0,
+        opcode.EXTENDED_ARG, 1, 0,
+        opcode.opmap['JUMP_ABSOLUTE'], 3, 0,
+        opcode.opmap['RETURN_VALUE']]))
+    code = types.CodeType(0, 0, 1, 0, code_string, (None,), (), (),
+        'test', 'test', 1, '')
+    bytecode = discovery.Bytecode(code)
+    assert list(bytecode.opcodes) == [opcode.opmap['LOAD_CONST'],
+        opcode.opmap['JUMP_ABSOLUTE'], opcode.opmap['RETURN_VALUE']]
+    assert list(bytecode.args) == [0x10002, 0x10003, 0]
+    assert list(bytecode.offsets) == [0, 6, 12, 13]
+    assert bytecode.labels == set([0x10003])
+    assert bytecode.index[6] == 1
+
+def test_lineno():
+    for func in (hello, hello2, dead_in_loop):
+        code = func.func_code
+        starts = list(findlinestarts(code))
+        bytecode = discovery.Bytecode(code)
+        for pc in bytecode.offsets[:-1]:
+            expect = [lineno for offset, lineno in starts if offset <= pc][-1]
+            assert bytecode.lineno(pc) == expect, (func, pc)
+
+# Reading used to recurse once per block.
+def test_many_branches():
+    count = 3000
+    source = "def branches(x, a):\n" + "".join(
+        "    if a:\n        x = {}\n    else:\n        x = {}\n".format(i, -i)
+        for i in range(count)) + "    return x\n"
+    namespace = {}
+    exec source in namespace
+    assert count * 3 > sys.getrecursionlimit()
+    proc = discovery.read(namespace['branches'])
+    assert len(proc.blocks) == count * 3 + 1
+    # Every if/else assigns x again, so only the last join needs a phi.
+    assert sum(len(block.phi) for block in proc.blocks) == 1
+
+if __name__=='__main__':
+    print discovery.read(hello)
+    test_dominators()
+    test_phis()
+    test_undefined()
+    test_swap()
+    test_rotations()
+    test_extended_arg()
+    test_lineno()
+    test_many_branches()
+    print 'ok'
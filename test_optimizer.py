@@ -0,0 +1,151 @@
+from array import array
+from spirv import *
+from test_spirv import sample_module
+import optimizer
+
+# The sequence the translator emits for 'a + b * 20', with a and b
+# constant, plus things that nothing uses.
+def arithmetic_module():
+    return [
+        Instruction('OpMemoryModel', 0, 0, ['Logical', 'GLSL450']),
+        Instruction('OpEntryPoint', 0, 0, ['Fragment', Id(4)]),
+        Instruction('OpName', 0, 0, [Id(4), u'main']),
+        Instruction('OpName', 0, 0, [Id(21), u'unused']),
+        Instruction('OpDecorate', 0, 0, [Id(13), 'Location', [0]]),
+        Instruction('OpTypeVoid', 0, 1, []),
+        Instruction('OpTypeFunction', 0, 2, [Id(1), []]),
+        Instruction('OpTypeInt', 0, 3, [32, 1]),
+        Instruction('OpTypeFloat', 0, 5, [32]),
+        Instruction('OpTypeVector', 0, 6, [Id(5), 4]),
+        Instruction('OpTypePointer', 0, 7, ['Output', Id(3)]),
+        Instruction('OpTypePointer', 0, 8, ['PrivateGlobal', Id(3)]),
+        Instruction('OpConstant', 3, 10, [[20]]),
+        Instruction('OpConstant', 3, 11, [[0xFFFFFFFF]]),
+        Instruction('OpConstant', 3, 12, [[7]]),
+        Instruction('OpVariable', 7, 13, ['Output', None]),
+        Instruction('OpVariable', 8, 14, ['PrivateGlobal', None]),
+        Instruction('OpFunction', 1, 4, [set(['DontInline']), Id(2)]),
+        Instruction('OpLabel', 0, 15, []),
+        Instruction('OpIMul', 3, 16, [Id(11), Id(10)]),
+        Instruction('OpIAdd', 3, 17, [Id(12), Id(16)]),
+        Instruction('OpSDiv', 3, 18, [Id(17), Id(12)]),
+        Instruction('OpISub', 3, 19, [Id(10), Id(12)]),
+        Instruction('OpStore', 0, 0, [Id(13), Id(18), []]),
+        Instruction('OpReturn', 0, 0, []),
+        Instruction('OpFunctionEnd', 0, 0, []),
+        Instruction('OpFunction', 1, 21, [set(['DontInline']), Id(2)]),
+        Instruction('OpLabel', 0, 22, []),
+        Instruction('OpStore', 0, 0, [Id(14), Id(10), []]),
+        Instruction('OpReturn', 0, 0, []),
+        Instruction('OpFunctionEnd', 0, 0, []),
+    ]
+
+def test_fold_constants():
+    instructions = optimizer.fold_constants(arithmetic_module())
+    index = ModuleIndex(instructions)
+    # -1 * 20 + 7 = -13, and -13 / 7 truncates to -1.
+    assert index[17].name == 'OpConstant' and index[17].args == [[(-13) & 0xFFFFFFFF]]
+    assert index[18].args == [[0xFFFFFFFF]]
+    assert index[19].args == [[13]]
+    assert all(instruction.name != 'OpConstant' for instruction in index.sections['functions'])
+
+def test_fold_overflow():
+    huge = optimizer.encode_constant(('float', 64), 1e308)
+    infinity = optimizer.encode_constant(('float', 64), float('inf'))
+    instructions = optimizer.fold_constants([
+        Instruction('OpTypeFloat', 0, 1, [64]),
+        Instruction('OpTypeFloat', 0, 2, [32]),
+        Instruction('OpConstant', 1, 3, [huge]),
+        Instruction('OpConstant', 1, 4, [infinity]),
+        Instruction('OpConstant', 2, 5, [[0x7F7FFFFF]]),
+        Instruction('OpFAdd', 1, 6, [Id(3), Id(3)]),
+        Instruction('OpFMul', 1, 7, [Id(3), Id(3)]),
+        Instruction('OpFSub', 1, 8, [Id(3), Id(3)]),
+        Instruction('OpFAdd', 1, 9, [Id(4), Id(3)]),
+        Instruction('OpFMul', 2, 10, [Id(5), Id(5)]),
+    ])
+    index = ModuleIndex(instructions)
+    assert [index[result_id].name for result_id in range(6, 11)] == [
+        'OpFAdd', 'OpFMul', 'OpConstant', 'OpConstant', 'OpFMul']
+    assert index[8].args == [[0, 0]]
+    assert index[9].args == [infinity]
+
+def test_eliminate_dead_code():
+    instructions = optimizer.optimize(arithmetic_module())
+    ids = set(instruction.result_id for instruction in instructions)
+    # The unused function goes, and the variable only it used, and
+    # the constants that only fed the folded ones.
+    assert ids == set([0, 1, 2, 3, 4, 7, 13, 15, 18])
+    assert [instruction.args[1] for instruction in instructions
+        if instruction.name == 'OpName'] == [u'main']
+    words = encode_spirv(instructions, 23)
+    instructions_, info = decode_spirv(array('I', words))
+    assert encode_spirv(instructions_, **info) == words
+
+def test_nothing_to_remove():
+    instructions = optimizer.optimize(sample_module())
+    assert [instruction.name for instruction in instructions] == [
+        instruction.name for instruction in sample_module()]
+
+# Two modules merged into one, with their own copies of the types.
+def merged_module():
+    return [
+        Instruction('OpSource', 0, 0, ['GLSL', 450]),
+        Instruction('OpMemoryModel', 0, 0, ['Logical', 'GLSL450']),
+        Instruction('OpEntryPoint', 0, 0, ['Fragment', Id(40)]),
+        Instruction('OpName', 0, 0, [Id(40), u'main']),
+        Instruction('OpName', 0, 0, [Id(33), u'color']),
+        Instruction('OpDecorate', 0, 0, [Id(12), 'Stride', [16]]),
+        Instruction('OpTypeVoid', 0, 1, []),
+        Instruction('OpTypeFunction', 0, 2, [Id(1), []]),
+        Instruction('OpTypeFloat', 0, 3, [32]),
+        Instruction('OpTypeVector', 0, 4, [Id(3), 4]),
+        Instruction('OpConstant', 3, 5, [[0]]),
+        Instruction('OpTypeInt', 0, 6, [32, 0]),
+        Instruction('OpConstant', 6, 7, [[4]]),
+        Instruction('OpTypeArray', 0, 11, [Id(4), Id(7)]),
+        Instruction('OpTypeArray', 0, 12, [Id(4), Id(7)]),
+        Instruction('OpTypeFloat', 0, 30, [32]),
+        Instruction('OpTypeVector', 0, 31, [Id(30), 4]),
+        Instruction('OpTypePointer', 0, 32, ['Output', Id(31)]),
+        Instruction('OpConstant', 30, 34, [[0]]),
+        Instruction('OpConstantComposite', 31, 35, [[Id(5), Id(34), Id(5), Id(34)]]),
+        Instruction('OpVariable', 32, 33, ['Output', None]),
+        Instruction('OpFunction', 1, 40, [set(), Id(2)]),
+        Instruction('OpLabel', 0, 41, []),
+        Instruction('OpStore', 0, 0, [Id(33), Id(35), []]),
+        Instruction('OpReturn', 0, 0, []),
+        Instruction('OpFunctionEnd', 0, 0, []),
+    ]
+
+def test_compact():
+    instructions, bound = optimizer.compact(merged_module(), 42)
+    index = ModuleIndex(instructions)
+    # The float, vector and zero were defined twice, the decorated
+    # array stays apart from its twin.
+    assert len(instructions) == len(merged_module()) - 3
+    assert bound == 15
+    assert sorted(index.definitions) == range(1, bound)
+    assert index[10].args == ['Output', Id(4)]
+    assert index[11].name == 'OpConstantComposite'
+    assert index[11].args == [[Id(5), Id(5), Id(5), Id(5)]]
+    assert index.name(12) == u'color'
+    assert index.decoration(9, 'Stride') == [16]
+    words = encode_spirv(instructions, bound)
+    instructions_, info = decode_spirv(array('I', words))
+    assert encode_spirv(instructions_, **info) == words
+
+def test_strip_debug():
+    instructions, bound = optimizer.compact(merged_module(), 42, strip=True)
+    names = set(instruction.name for instruction in instructions)
+    assert not names & set(['OpSource', 'OpName'])
+    assert bound == 15
+
+if __name__=='__main__':
+    test_fold_constants()
+    test_fold_overflow()
+    test_eliminate_dead_code()
+    test_nothing_to_remove()
+    test_compact()
+    test_strip_debug()
+    print 'ok'
@@ -0,0 +1,74 @@
+from annotator import *
+from StringIO import StringIO
+import json
+import multiprocessing
+import profiling
+import translate
+
+def loop(x, y, z):
+    while x:
+        y = 10
+        if True:
+            z = 20
+    return z
+
+# Every phase takes a second on this clock.
+def ticking():
+    ticks = iter(range(1000))
+    return lambda: float(next(ticks))
+
+def test_profile():
+    unit = translate.TranslationUnit()
+    with profiling.Profile(clock=ticking()) as profile:
+        proc = unit.build_function(FuncType(t_int, [t_bool, t_int, t_int]), loop)
+        unit.annotator.run()
+    assert profiling.active is None
+    name = '__main__.loop' if __name__ == '__main__' else 'test_profiling.loop'
+    assert profile.counters['blocks'] == len(proc.blocks)
+    assert profile.counters['annotator iterations'] == unit.annotator.iterations
+    assert profile.functions[name]['blocks'] == len(proc.blocks)
+    assert profile.phases['read'][0] == 1
+    assert profile.phases['rename'] == [1, 1.0]
+    # read covers interpret, ssa_conversion and the four phases in it.
+    assert profile.functions[name]['read'] == 13.0
+    assert sum(profile.folded.values()) == sum(seconds
+        for calls, seconds in [profile.phases['discover'], profile.phases['annotate']])
+    folded = StringIO()
+    profile.write_folded(folded)
+    assert 'discover;read({});ssa_conversion;rename 1000000\n'.format(name) in folded.getvalue()
+    trace = StringIO()
+    profile.write_trace(trace)
+    events = json.loads(trace.getvalue())['traceEvents']
+    assert len(events) == sum(calls for calls, seconds in profile.phases.values())
+    assert [event['args']['blocks'] for event in events
+        if event['cat'] == 'read'] == [len(proc.blocks)]
+
+def constant(x):
+    return 5
+
+def profiling_active(_):
+    return profiling.active is not None
+
+def test_workers():
+    with profiling.Profile() as profile:
+        pool = multiprocessing.Pool(1, translate.stop_profiling)
+        try:
+            assert pool.map(profiling_active, [0]) == [False]
+        finally:
+            pool.terminate()
+        procs = translate.discover([loop, constant], jobs=2)
+    assert profile.counters['blocks'] == sum(len(proc.blocks) for proc in procs)
+    assert 'read' not in profile.phases
+
+def test_disabled():
+    assert profiling.phase('read') is profiling.disabled
+    profiling.count('blocks', 10)
+    unit = translate.TranslationUnit()
+    unit.build_function(FuncType(t_int, [t_bool, t_int, t_int]), loop)
+    unit.annotator.run()
+
+if __name__=='__main__':
+    test_profile()
+    test_workers()
+    test_disabled()
+    print 'ok'
@@ -0,0 +1,41 @@
+from array import array
+from test_spirv import sample_module
+import reflection
+import spirv
+
+def test_reflect():
+    data = array('I', spirv.encode_spirv(sample_module(), 12))
+    info = reflection.reflect(data)
+    entry, = info.entry_points
+    assert entry.model == 'Fragment' and entry.name == u'main'
+    assert entry.modes == [('OriginUpperLeft', [])]
+    var, = info.variables
+    assert var.name == u'color' and var.location == 0
+    assert var.storage_class == 'Output'
+    assert var.type == ('vector', ('float', 32), 4)
+    assert info.outputs() == [var] and info.inputs() == []
+    assert info.member_names == {7: {1: u'abcd'}}
+    # Nothing past the first function gets decoded.
+    assert 5 not in info.offsets
+
+def test_groups():
+    instructions = sample_module()
+    instructions[8:8] = [
+        spirv.Instruction('OpDecorate', 0, 0, [spirv.Id(20), 'Binding', [3]]),
+        spirv.Instruction('OpDecorate', 0, 0, [spirv.Id(20), 'DescriptorSet', [1]]),
+        spirv.Instruction('OpMemberDecorate', 0, 0, [spirv.Id(20), 0, 'Offset', [16]]),
+        spirv.Instruction('OpDecorationGroup', 0, 20, []),
+        spirv.Instruction('OpGroupDecorate', 0, 0, [spirv.Id(20), [spirv.Id(9)]]),
+    ]
+    info = reflection.reflect(array('I', spirv.encode_spirv(instructions, 21)))
+    var, = info.variables
+    assert var.decorations == {'Location':[0], 'Binding':[3], 'DescriptorSet':[1]}
+    assert info.descriptors() == {(1, 3): var}
+    assert spirv.ModuleIndex(instructions).decoration(9, 'Binding') == [3]
+    assert info.member_decorations == {9: {0: {'Offset':[16]}}}
+    assert 20 not in info.decorations
+
+if __name__=='__main__':
+    test_reflect()
+    test_groups()
+    print 'ok'
@@ -0,0 +1,273 @@
+from array import array
+from spirv import *
+import io
+import tempfile
+
+# A small module that covers most of the operand kinds.
+def sample_module():
+    return [
+        Instruction('OpSource', 0, 0, ['GLSL', 450]),
+        Instruction('OpExtInstImport', 0, 1, [u'GLSL.std.450']),
+        Instruction('OpMemoryModel', 0, 0, ['Logical', 'GLSL450']),
+        Instruction('OpEntryPoint', 0, 0, ['Fragment', Id(4)]),
+        Instruction('OpExecutionMode', 0, 0, [Id(4), 'OriginUpperLeft', []]),
+        Instruction('OpName', 0, 0, [Id(4), u'main']),
+        Instruction('OpName', 0, 0, [Id(9), u'color']),
+        Instruction('OpDecorate', 0, 0, [Id(9), 'Location', [0]]),
+        Instruction('OpMemberName', 0, 0, [Id(7), 1, u'abcd']),
+        Instruction('OpTypeVoid', 0, 2, []),
+        Instruction('OpTypeFunction', 0, 3, [Id(2), []]),
+        Instruction('OpTypeFloat', 0, 6, [32]),
+        Instruction('OpTypeVector', 0, 7, [Id(6), 4]),
+        Instruction('OpTypePointer', 0, 8, ['Output', Id(7)]),
+        Instruction('OpVariable', 8, 9, ['Output', None]),
+        Instruction('OpConstant', 6, 10, [[0x3f800000]]),
+        Instruction('OpConstantComposite', 7, 11, [[Id(10), Id(10), Id(10), Id(10)]]),
+        Instruction('OpFunction', 2, 4, [set(['DontInline']), Id(3)]),
+        Instruction('OpLabel', 0, 5, []),
+        Instruction('OpStore', 0, 0, [Id(9), Id(11), []]),
+        Instruction('OpSwitch', 0, 0, [Id(10), Id(5), [(1, Id(5)), (2, Id(5))]]),
+        Instruction('OpReturn', 0, 0, []),
+        Instruction('OpFunctionEnd', 0, 0, []),
+    ]
+
+def same(a, b):
+    assert a.name == b.name, (a, b)
+    assert a.type_id == b.type_id, (a, b)
+    assert a.result_id == b.result_id, (a, b)
+    assert a.args == b.args, (a, b)
+
+def test_roundtrip():
+    words = encode_spirv(sample_module(), 12)
+    instructions, info = decode_spirv(array('I', words))
+    assert info == {'bound': 12, 'generator_id': 0}
+    for a, b in zip(sample_module(), instructions):
+        same(a, b)
+    assert encode_spirv(instructions, **info) == words
+
+def test_bad_instruction():
+    fmt = opname_table['OpTypeVector']
+    instruction = decode_instruction(fmt['opcode'], [7, 6])
+    assert isinstance(instruction, UnknownInstruction)
+    assert instruction.traceback is not None
+    instruction = decode_instruction(fmt['opcode'], [7, 6, 4, 0])
+    assert isinstance(instruction, UnknownInstruction)
+    instruction = decode_instruction(fmt['opcode'], [7, 6, 4])
+    assert instruction.args == [Id(6), 4]
+    instruction = decode_instruction(0xFFFF, [1, 2])
+    assert isinstance(instruction, UnknownInstruction)
+    assert instruction.traceback is None
+
+def test_lazy_module():
+    words = encode_spirv(sample_module(), 12)
+    module, info = decode_spirv_lazy(array('I', words))
+    assert len(module) == len(sample_module())
+    assert len(module.decoded) == 0
+    assert module.opcode(3) == opname_table['OpEntryPoint']['opcode']
+    same(module[-1], sample_module()[-1])
+    assert len(module.decoded) == 1
+    # Untouched instructions are copied, touched ones are re-encoded.
+    assert encode_spirv(module, **info) == words
+    module[5].args[1] = u'entry'
+    instructions, _ = decode_spirv(array('I', encode_spirv(module, **info)))
+    assert instructions[5].args[1] == u'entry'
+    assert len(module.decoded) == 2
+
+def test_opposite_endian():
+    words = encode_spirv(sample_module(), 12)
+    data = array('I', words)
+    data.byteswap()
+    swapped = data.tostring()
+    instructions, info = decode_spirv(data)
+    assert data.tostring() == swapped # The caller's buffer is left alone.
+    assert encode_spirv(instructions, **info) == words
+
+def test_load_mapped():
+    words = encode_spirv(sample_module(), 12)
+    for swap in [False, True]:
+        data = array('I', words)
+        if swap:
+            data.byteswap()
+        with tempfile.TemporaryFile() as fd:
+            fd.write(data.tostring())
+            fd.flush()
+            module, info = load_mapped(fd)
+            assert info['bound'] == 12
+            assert encode_spirv(module, **info) == words
+            same(module[3], sample_module()[3])
+            instructions, info = load_mapped(fd, lazy=False)
+            assert encode_spirv(instructions, **info) == words
+
+def test_shared_ids():
+    words = encode_spirv(sample_module(), 12)
+    instructions, info = decode_spirv(array('I', words))
+    assert instructions[5].args[0] is instructions[3].args[1]
+    assert instructions[5].args[0] == Id(4)
+    assert Id(4) != Id(5)
+    assert len(set([Id(4), Id(4), Id(5)])) == 2
+
+def test_packed_module():
+    words = encode_spirv(sample_module(), 12)
+    module, info = decode_spirv_packed(array('I', words))
+    assert len(module) == len(sample_module())
+    for a, b in zip(sample_module(), module):
+        same(a, b)
+    assert module.result_ids[14] == 9 and module.type_ids[14] == 8
+    assert encode_spirv(module, **info) == words
+    # Instructions too short to hold their result id are kept whole.
+    fmt = opname_table['OpLabel']
+    words = words + [1 << 16 | fmt['opcode']]
+    module, info = decode_spirv_packed(array('I', words))
+    assert isinstance(module[-1], UnknownInstruction)
+    assert encode_spirv(module, **info) == words
+
+def test_writer():
+    data = stringify_spirv(encode_spirv(sample_module(), 12))
+    for bound in [12, None]:
+        fd = io.BytesIO()
+        fd.write('prefix')
+        assert write_spirv(fd, iter(sample_module()), bound) == 12
+        assert fd.getvalue() == 'prefix' + data
+    fd = io.BytesIO()
+    writer = Writer(fd, chunk_size=8)
+    module, info = decode_spirv_lazy(array('I', data))
+    for index in range(len(module)):
+        writer.write_words(module.words(index))
+    assert writer.close() == 12
+    assert fd.getvalue() == data
+
+def test_module_index():
+    index = ModuleIndex(sample_module())
+    assert index[9].name == 'OpVariable'
+    assert index.get('OpEntryPoint')[0].args[1] == Id(4)
+    assert index.name(4) == u'main'
+    assert index.decoration(9, 'Location') == [0]
+    assert index.decoration(9, 'Binding') is None
+    assert [i.name for i in index.sections['memory_model']] == ['OpMemoryModel']
+    assert len(index.sections['debug']) == 3
+    assert len(index.sections['globals']) == 8
+    assert index.sections['functions'][0].name == 'OpFunction'
+    assert index.sections['functions'][-1].name == 'OpFunctionEnd'
+    assert sum(map(len, index.sections.values())) == len(sample_module())
+
+# Sample module with the ids numbered backwards and the names and
+# decorations in another order.
+def shuffled_module():
+    def renumber(arg):
+        if isinstance(arg, Id):
+            return Id(100 - arg.result_id)
+        if isinstance(arg, list):
+            return map(renumber, arg)
+        if isinstance(arg, tuple):
+            return tuple(map(renumber, arg))
+        return arg
+    instructions = []
+    for instruction in sample_module():
+        instructions.append(Instruction(instruction.name,
+            instruction.type_id and 100 - instruction.type_id,
+            instruction.result_id and 100 - instruction.result_id,
+            map(renumber, instruction.args)))
+    instructions[5:9] = reversed(instructions[5:9])
+    return instructions
+
+def test_canonical_hash():
+    digest = canonical_hash(sample_module())
+    assert canonical_hash(shuffled_module()) == digest
+    words = encode_spirv(shuffled_module(), 101)
+    assert canonical_hash(decode_spirv_lazy(array('I', words))[0]) == digest
+    assert canonical_hash(decode_spirv_packed(array('I', words))[0]) == digest
+    instructions = sample_module()
+    instructions[15].args = [[0x40000000]]
+    assert canonical_hash(instructions) != digest
+    instructions = sample_module()
+    instructions[6].args[1] = u'colour'
+    assert canonical_hash(instructions) != digest
+    # Swapping the names of two ids is a different module.
+    instructions = sample_module()
+    instructions[5].args[0], instructions[6].args[0] = Id(9), Id(4)
+    assert canonical_hash(instructions) != digest
+    # A decoration given twice is not the same as once.
+    instructions = sample_module()
+    instructions.insert(7, instructions[7])
+    assert canonical_hash(instructions) != digest
+
+# The sample module with a second output, and a helper function that
+# main calls.
+def two_outputs():
+    instructions = sample_module()
+    instructions[15:15] = [Instruction('OpVariable', 8, 12, ['Output', None])]
+    instructions[8:8] = [Instruction('OpDecorate', 0, 0, [Id(12), 'Location', [1]])]
+    instructions[19:19] = [
+        Instruction('OpFunction', 2, 13, [set(), Id(3)]),
+        Instruction('OpLabel', 0, 14, []),
+        Instruction('OpStore', 0, 0, [Id(12), Id(11), []]),
+        Instruction('OpReturn', 0, 0, []),
+        Instruction('OpFunctionEnd', 0, 0, []),
+    ]
+    instructions.insert(26, Instruction('OpFunctionCall', 2, 15, [Id(13), []]))
+    return instructions
+
+def test_canonical_hash_order():
+    digest = canonical_hash(sample_module())
+    instructions = sample_module()
+    instructions[9:12] = [instructions[11], instructions[9], instructions[10]]
+    assert canonical_hash(instructions) == digest
+    instructions = sample_module()
+    instructions[0:3] = reversed(instructions[0:3])
+    assert canonical_hash(instructions) == digest
+    digest = canonical_hash(two_outputs())
+    # The two outputs are told apart by their decorations.
+    instructions = two_outputs()
+    instructions[15], instructions[16] = instructions[16], instructions[15]
+    assert canonical_hash(instructions) == digest
+    instructions = two_outputs()
+    instructions[21].args[0] = Id(9)
+    assert canonical_hash(instructions) != digest
+    # The functions in the other order, so main calls one further down.
+    instructions = two_outputs()
+    instructions[19:] = instructions[24:] + instructions[19:24]
+    assert instructions[19].result_id == 4
+    assert canonical_hash(instructions) == digest
+    words = encode_spirv(instructions, 16)
+    assert canonical_hash(decode_spirv_lazy(array('I', words))[0]) == digest
+    instructions[19:] = instructions[19:20] + instructions[21:22] + instructions[20:21] + instructions[22:]
+    assert canonical_hash(instructions) != digest
+
+def test_canonical_hash_undecoded():
+    opcode = opname_table['OpTypeVector']['opcode']
+    digest = canonical_hash(sample_module())
+    instructions = sample_module() + [UnknownInstruction(opcode, [7], None)]
+    assert canonical_hash(instructions) not in (digest, canonical_hash(sample_module() + [
+        UnknownInstruction(opcode, [8], None)]))
+    words = encode_spirv(instructions, 12)
+    assert canonical_hash(decode_spirv_lazy(array('I', words))[0]) == canonical_hash(instructions)
+    assert canonical_hash(decode_spirv_packed(array('I', words))[0]) == canonical_hash(instructions)
+
+def test_canonical_hash_groups():
+    group = [
+        Instruction('OpDecorate', 0, 0, [Id(20), 'Flat', []]),
+        Instruction('OpDecorationGroup', 0, 20, []),
+        Instruction('OpGroupDecorate', 0, 0, [Id(20), [Id(9)]]),
+    ]
+    flat = [Instruction('OpDecorate', 0, 0, [Id(9), 'Flat', []])]
+    instructions = sample_module()
+    instructions[8:8] = group
+    instructions_ = sample_module()
+    instructions_[8:8] = flat
+    assert canonical_hash(instructions) == canonical_hash(instructions_)
+
+if __name__=='__main__':
+    test_roundtrip()
+    test_bad_instruction()
+    test_lazy_module()
+    test_opposite_endian()
+    test_load_mapped()
+    test_shared_ids()
+    test_packed_module()
+    test_writer()
+    test_module_index()
+    test_canonical_hash()
+    test_canonical_hash_groups()
+    test_canonical_hash_order()
+    test_canonical_hash_undecoded()
+    print 'ok'
@@ -0,0 +1,107 @@
+from annotator import *
+import cPickle
+import discovery
+import translate
+
+def loop(x, y, z):
+    while x:
+        y = 10
+        if True:
+            z = 20
+    return z
+
+def branches(x, a, b):
+    if a:
+        x = 3
+        if b:
+            pass
+        x = 10
+    return x
+
+def constant(x):
+    return 5
+
+# Block indices and result ids, everything that should be the same
+# whichever process discovered the procedure.
+def signature(proc):
+    result = []
+    for block in proc.blocks:
+        phis = sorted((variable.name, repr(phi), sorted(
+            (prec.index, repr(arg)) for prec, arg in phi.args.items()))
+            for variable, phi in block.phi.items())
+        result.append((phis, map(str, block.instructions),
+            sorted(prec.index for prec in block.prec)))
+    return result
+
+def test_pickle():
+    proc = discovery.read(loop)
+    proc_ = cPickle.loads(cPickle.dumps(proc, 2))
+    assert proc_.func is None
+    proc_.func = loop
+    assert signature(proc) == signature(proc_)
+    assert [block.idom and block.idom.index for block in proc_.blocks] == [
+        block.idom and block.idom.index for block in proc.blocks]
+
+def test_parallel():
+    functions = [
+        (FuncType(t_int, [t_bool, t_int, t_int]), loop),
+        (FuncType(t_int, [t_int, t_bool, t_bool]), branches),
+        (FuncType(t_int, [t_int]), constant)]
+    serial = translate.TranslationUnit()
+    parallel = translate.TranslationUnit(jobs=2)
+    procs = serial.build_functions(functions)
+    procs_ = parallel.build_functions(functions)
+    for proc, proc_ in zip(procs, procs_):
+        assert proc_.func is proc.func
+        assert signature(proc) == signature(proc_)
+    serial.annotator.run()
+    parallel.annotator.run()
+    assert [proc.annotation for proc in procs] == [proc.annotation for proc in procs_]
+
+# The functions of the refresh tests live in their own namespace, so
+# their globals and code can be changed.
+def refresh_unit():
+    namespace = {}
+    exec ("K = 5\n"
+        "def f(x):\n    return K\n"
+        "def g(x):\n    f\n    return x\n") in namespace
+    unit = translate.TranslationUnit()
+    f = unit.build_function(FuncType(None, [t_int]), namespace['f'])
+    g = unit.build_function(FuncType(None, [t_int]), namespace['g'])
+    unit.annotator.run()
+    assert f.annotation.restype is Constant(t_int, 5)
+    assert g.annotation.restype is t_int
+    return unit, namespace
+
+def test_refresh_global():
+    unit, namespace = refresh_unit()
+    namespace['K'] = 6
+    stats = unit.refresh()
+    # g refers to f, so it is annotated again too.
+    assert stats.reannotated == [namespace['f'], namespace['g']]
+    assert stats.rediscovered == []
+    unit.annotator.run()
+    assert unit.procedures[namespace['f']].annotation.restype is Constant(t_int, 6)
+
+def test_refresh_code():
+    unit, namespace = refresh_unit()
+    old = unit.procedures[namespace['f']]
+    changed = {}
+    exec "def f(x):\n    return 7.5\n" in changed
+    namespace['f'].func_code = changed['f'].func_code
+    stats = unit.refresh()
+    assert stats.rediscovered == [namespace['f']]
+    assert stats.reannotated == [namespace['g']]
+    unit.annotator.run()
+    proc = unit.procedures[namespace['f']]
+    assert proc is not old
+    assert proc.annotation.restype is Constant(t_float, 7.5)
+    assert not any(value in unit.annotator.users for value in old.values())
+    assert unit.refresh().kept == [namespace['f'], namespace['g']]
+
+if __name__=='__main__':
+    test_pickle()
+    test_parallel()
+    test_refresh_global()
+    test_refresh_code()
+    print 'ok'
@@ -0,0 +1,138 @@
+from array import array
+from spirv import *
+from test_spirv import sample_module
+import validator
+
+# The sample module, with the member name before the decorations, and
+# without the return after the switch.
+def valid_module():
+    instructions = sample_module()
+    instructions[7], instructions[8] = instructions[8], instructions[7]
+    del instructions[21]
+    return instructions
+
+def problems(instructions, bound=12):
+    return [message for index, message in validator.validate(instructions, bound)]
+
+def test_valid():
+    assert problems(valid_module()) == []
+    words = encode_spirv(valid_module(), 12)
+    assert validator.validate(decode_spirv_lazy(array('I', words))[0], 12) == []
+
+def test_ids():
+    assert problems(valid_module(), 11) == [
+        'result id 11 is not below the bound 11',
+        'id 11 is not below the bound 11']
+    instructions = valid_module()
+    instructions[15].result_id = 6
+    assert problems(instructions) == [
+        'id 6 is defined twice', 'id 10 is used before it is defined']
+    instructions = valid_module()
+    instructions[14].type_id = 6
+    assert problems(instructions) == []
+    instructions[14].type_id = 10
+    assert problems(instructions) == ['id 10 is used before it is defined']
+    instructions[14].type_id = 9
+    assert problems(instructions) == ['id 9 is used before it is defined']
+    instructions = valid_module()
+    instructions[15].type_id = 9
+    assert problems(instructions) == ['id 9 should be a type']
+
+def test_bound():
+    assert problems(valid_module(), 100) == []
+    instructions = valid_module()
+    instructions[15].result_id = 6
+    assert problems(instructions, 100) == [
+        'id 6 is defined twice', 'id 10 is used before it is defined']
+    instructions = valid_module()
+    instructions[3].args[1] = Id(50)
+    assert problems(instructions, 100) == ['id 50 is never defined']
+    assert problems(valid_module(), 0xFFFFFFFF) == ['the bound 4294967295 is above the limit 4194303']
+
+def test_forward():
+    instructions = valid_module()
+    instructions[5].args[0] = Id(3)
+    assert problems(instructions) == []
+    instructions = valid_module()
+    instructions[3].args[1] = Id(3)
+    assert problems(instructions) == []
+    instructions[5].args[0] = Id(1)
+    instructions[3].args[1] = Id(13)
+    instructions[13] = Instruction('OpTypePointer', 0, 8, ['Output', Id(7)])
+    assert problems(instructions, 14) == ['id 13 is never defined']
+    instructions = valid_module()
+    instructions[20].args[1] = Id(10)
+    assert problems(instructions) == ['id 10 should be a label']
+    instructions[20].args[1] = Id(5)
+    instructions[20].args[0] = Id(11)
+    assert problems(instructions) == []
+
+def test_layout():
+    instructions = valid_module()
+    instructions.insert(2, instructions.pop(8))
+    assert problems(instructions) == [
+        'OpMemoryModel is out of order, it belongs to the memory_model section',
+        'OpEntryPoint is out of order, it belongs to the entry_points section',
+        'OpExecutionMode is out of order, it belongs to the execution_modes section',
+        'OpName is out of order, it belongs to the debug section',
+        'OpName is out of order, it belongs to the debug section',
+        'OpMemberName is out of order, it belongs to the debug section']
+    instructions = valid_module()
+    instructions.insert(19, Instruction('OpTypeBool', 0, 12, []))
+    assert problems(instructions, 13) == ['OpTypeBool is not allowed in a function']
+    instructions = valid_module()
+    del instructions[20]
+    assert problems(instructions) == ['the last block has no terminator']
+    instructions = valid_module()
+    instructions.insert(20, Instruction('OpLabel', 0, 12, []))
+    assert problems(instructions, 13) == ['the block before this label has no terminator']
+    instructions = valid_module()
+    instructions.insert(16, instructions[19])
+    assert problems(instructions) == ['OpStore appears outside of a function',
+        'id 11 is used before it is defined']
+    instructions = valid_module()
+    del instructions[-1]
+    assert problems(instructions) == ['the last function has no OpFunctionEnd']
+
+# A function imported by linkage is declared without blocks.
+def test_linkage():
+    declaration = [
+        Instruction('OpFunction', 2, 12, [set(), Id(3)]),
+        Instruction('OpFunctionEnd', 0, 0, []),
+    ]
+    instructions = valid_module() + declaration
+    assert problems(instructions, 13) == ['function without blocks']
+    instructions.insert(9, Instruction('OpDecorate', 0, 0, [Id(12), 'LinkageType', [0]]))
+    assert problems(instructions, 13) == ['function without blocks']
+    instructions[9].args[2] = [1]
+    assert problems(instructions, 13) == []
+    instructions[9:10] = [
+        Instruction('OpDecorate', 0, 0, [Id(13), 'LinkageType', [1]]),
+        Instruction('OpDecorationGroup', 0, 13, []),
+        Instruction('OpGroupDecorate', 0, 0, [Id(13), [Id(12)]]),
+    ]
+    assert problems(instructions, 14) == []
+
+def test_flags():
+    instructions = valid_module()
+    instructions[19].result_id = 12
+    instructions[10].type_id = 2
+    assert problems(instructions, 13) == [
+        'OpTypeFunction should not have a result type',
+        'OpStore should not have a result id']
+    instructions = valid_module()
+    instructions[19].args.pop()
+    instructions.append(UnknownInstruction(0x7FFF, [1], None))
+    assert problems(instructions) == [
+        'OpStore has 2 operands, expected 3',
+        'opcode 32767 did not decode: unknown opcode']
+
+if __name__=='__main__':
+    test_valid()
+    test_ids()
+    test_bound()
+    test_forward()
+    test_layout()
+    test_linkage()
+    test_flags()
+    print 'ok'
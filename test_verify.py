@@ -0,0 +1,61 @@
+from StringIO import StringIO
+import json
+import os
+import shutil
+import sys
+import tempfile
+from spirv import *
+from test_spirv import sample_module
+import verify
+
+# A file that round-trips, one with an OpName whose string has garbage
+# after its terminator, and one that isn't SPIR-V at all.
+def write_corpus(directory):
+    words = encode_spirv(sample_module(), 12)
+    with open(os.path.join(directory, 'good.spv'), 'wb') as fd:
+        fd.write(stringify_spirv(words))
+    index = 5 + sum(len(encode_words(instruction)) for instruction in sample_module()[:5])
+    assert words[index] & 0xFFFF == opname_table['OpName']['opcode']
+    words[index + 2] = 0x6E69616D # 'main'
+    words[index + 3] = 0xFF00     # the terminator, with garbage
+    with open(os.path.join(directory, 'bad.spv'), 'wb') as fd:
+        fd.write(stringify_spirv(words))
+    with open(os.path.join(directory, 'text.spv'), 'wb') as fd:
+        fd.write('not a shader')
+
+def run(argv):
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = StringIO(), StringIO()
+    try:
+        status = verify.main(argv)
+        return status, sys.stdout.getvalue(), sys.stderr.getvalue()
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+def test_verify():
+    directory = tempfile.mkdtemp()
+    try:
+        write_corpus(directory)
+        status, out, err = run([directory, '-j', '1', '--json', '-'])
+        assert status == 1
+        summary = json.loads(out)
+        assert (summary['files'], summary['ok'], summary['failed']) == (3, 1, 2)
+        assert summary['instructions'] == 2 * len(sample_module())
+        results = dict((os.path.basename(result['path']), result)
+            for result in summary['results'])
+        assert results['good.spv']['status'] == 'ok'
+        assert results['bad.spv']['status'] == 'mismatch'
+        assert results['bad.spv']['mismatch']['index'] == 5
+        assert 'traceback' in results['bad.spv']['mismatch']
+        assert results['text.spv']['status'] == 'error'
+        assert 'mismatch   ' in err and '3 files, 1 ok, 2 failed' in err
+        # Without json the reports go to stdout.
+        status, out, err = run([os.path.join(directory, 'good.spv'), '-j', '1'])
+        assert status == 0
+        assert out.startswith('ok ') and out.count('\n') == 1
+    finally:
+        shutil.rmtree(directory)
+
+if __name__=='__main__':
+    test_verify()
+    print 'ok'
@@ -1,19 +1,273 @@
+from array import array
+import __builtin__
+import hashlib
+import marshal
+import multiprocessing
+import sys
+import types
 import annotator
 import discovery
+import profiling
+import spirv
 
 class TranslationUnit(object):
-    def __init__(self):
+    def __init__(self, cache=None, jobs=1):
         self.annotator = annotator.Annotator(self)
+        self.jobs = jobs # Processes for discovery, None for every core.
         self.procedures = {}
+        self.order = []
+        self.functypes = {}
+        self.cache = cache # cache.DiskCache, if the results should persist.
+        self.keys = {}
+        # The dependency graph tells what needs to be rebuilt on a change.
+        self.code_prints = {} # func -> fingerprint of its own code
+        self.uses = {}        # func -> {global name: fingerprint of the value}
+        self.callers = {}     # func -> functions that refer to it
 
     def build_function(self, functype, func):
-        if func not in self.procedures:
-            self.procedures[func] = proc = discovery.read(func)
-            proc.annotation = functype
+        return self.build_functions([(functype, func)])[0]
+
+    # The functions that aren't in the cache are discovered together,
+    # in parallel if the unit has more than one job.
+    def build_functions(self, functions):
+        funcs = []
+        for functype, func in functions:
+            if func not in self.functypes:
+                self.order.append(func)
+                self.functypes[func] = functype
+                self.record(func)
+                funcs.append(func)
+        self.load(funcs)
+        return [self.procedures[func] for functype, func in functions]
+
+    # When the translation of the function is found from the cache,
+    # the discovery, annotation and emission are all skipped.
+    def load(self, funcs):
+        pending = []
+        for func in funcs:
+            functype = self.functypes[func]
+            if self.cache is not None:
+                with profiling.phase('cache lookup', func):
+                    self.keys[func] = key = cache_key(func, functype)
+                    data = self.cache.get(key)
+                    if data is not None:
+                        instructions, info = spirv.decode_spirv(array('I', data))
+                        self.procedures[func] = Cached(func, functype, instructions)
+                if data is not None:
+                    profiling.count('cache hits', 1, func)
+                    continue
+                profiling.count('cache misses', 1, func)
+            pending.append(func)
+        with profiling.phase('discover'):
+            procs = discover(pending, self.jobs)
+        for func, proc in zip(pending, procs):
+            proc.annotation = self.functypes[func]
             self.annotator.update(proc)
-            return proc
-        return self.procedures[proc]
+            self.procedures[func] = proc
+
+    def record(self, func):
+        self.code_prints[func] = fingerprint_code(func.func_code)
+        self.uses[func] = uses = {}
+        for name in global_names(func.func_code):
+            uses[name] = fingerprint_global(func, name, None)
+            value = func.func_globals.get(name)
+            if isinstance(value, types.FunctionType):
+                self.callers.setdefault(value, set()).add(func)
+
+    # Call after functions, or the globals they use, have changed. The
+    # functions whose code changed are discovered again. They, and the
+    # functions that refer to changed globals, get annotated again, and
+    # so do their callers because the annotations flow into the callers.
+    # Everything else keeps its procedure and annotations.
+    def refresh(self):
+        rediscover = set()
+        reannotate = set()
+        for func in self.order:
+            if fingerprint_code(func.func_code) != self.code_prints[func]:
+                rediscover.add(func)
+            elif any(fingerprint_global(func, name, None) != value
+                    for name, value in self.uses[func].items()):
+                reannotate.add(func)
+        pending = list(rediscover | reannotate)
+        while len(pending) > 0:
+            for caller in self.callers.get(pending.pop(), ()):
+                if caller in self.procedures and caller not in rediscover | reannotate:
+                    reannotate.add(caller)
+                    pending.append(caller)
+        stats = RebuildStats()
+        for func in self.order:
+            proc = self.procedures[func]
+            if func in rediscover or func in reannotate:
+                self.record(func)
+            # Cached results have nothing to annotate, they're looked up again.
+            if func in rediscover or (func in reannotate and isinstance(proc, Cached)):
+                if not isinstance(proc, Cached):
+                    self.annotator.remove(proc)
+                stats.rediscovered.append(func)
+            elif func in reannotate:
+                # The globals are dropped along with the values, and
+                # update() resets and schedules them again.
+                self.annotator.remove(proc)
+                proc.annotation = self.functypes[func]
+                for value in proc.values():
+                    value.annotation = None
+                self.annotator.update(proc)
+                stats.reannotated.append(func)
+            else:
+                stats.kept.append(func)
+                if not isinstance(proc, Cached):
+                    stats.kept_blocks += len(proc.blocks)
+                    stats.kept_values += sum(1 for value in proc.values())
+        self.load(stats.rediscovered)
+        return stats
 
     def translate(self):
         # should translate the program, or crash.
+        instructions = []
+        with profiling.phase('translate'):
+            for func in self.order:
+                proc = self.procedures[func]
+                if isinstance(proc, Cached):
+                    instructions.extend(proc.instructions)
+                    continue
+                with profiling.phase('emit', func):
+                    emitted = self.emit(proc)
+                if self.cache is not None:
+                    with profiling.phase('cache store', func):
+                        bound = max([0] + [op.result_id for op in emitted
+                            if isinstance(op, spirv.Instruction)]) + 1
+                        self.cache.put(self.keys[func],
+                            spirv.stringify_spirv(spirv.encode_spirv(emitted, bound)))
+                instructions.extend(emitted)
+        return instructions
+
+    def emit(self, proc):
         return []
+
+# Discovery of a function doesn't depend on the other functions, so the
+# functions can be discovered in separate processes. Functions don't
+# pickle, so their code is sent marshaled, and the procedures get their
+# functions back here. Every procedure numbers its values from 1, so the
+# result ids are the same as if they were discovered here.
+def discover(funcs, jobs=1):
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    # Closures can't be rebuilt from the code alone.
+    remote = [func for func in funcs if func.func_closure is None]
+    if jobs <= 1 or len(remote) < 2:
+        return [discovery.read(func) for func in funcs]
+    pool = multiprocessing.Pool(min(jobs, len(remote)), stop_profiling)
+    try:
+        procs = pool.map(discover_code,
+            [marshal.dumps(func.func_code) for func in remote])
+    finally:
+        pool.terminate()
+    # The workers don't profile, as their timings would go away with
+    # them, but the sizes can be counted here.
+    for func, proc in zip(remote, procs):
+        proc.func = func
+        discovery.count_values(proc)
+    procs = dict(zip(remote, procs))
+    return [procs[func] if func in procs else discovery.read(func) for func in funcs]
+
+def discover_code(data):
+    return discovery.read(types.FunctionType(marshal.loads(data), {}))
+
+# Forked workers inherit the profile of the parent.
+def stop_profiling():
+    profiling.active = None
+
+class RebuildStats(object):
+    def __init__(self):
+        self.rediscovered = []
+        self.reannotated = []
+        self.kept = []
+        self.kept_blocks = 0 # The work skipped by keeping procedures.
+        self.kept_values = 0
+
+    def __repr__(self):
+        return ("RebuildStats(rediscovered={}, reannotated={}, kept={}, "
+            "kept_blocks={}, kept_values={})").format(
+            len(self.rediscovered), len(self.reannotated), len(self.kept),
+            self.kept_blocks, self.kept_values)
+
+# Stands in for the procedure when its translation came from the cache.
+class Cached(object):
+    def __init__(self, func, annotation, instructions):
+        self.func = func
+        self.annotation = annotation
+        self.instructions = instructions
+
+    def __repr__(self):
+        return "Cached({})".format(self.func)
+
+# The cache key covers everything the translation of a function depends
+# on: its bytecode and constants, the globals it refers to, the function
+# type it's translated with, the spirv.json and the translator itself.
+def cache_key(func, functype):
+    return hashlib.sha1(repr((
+        compiler_digest(),
+        spirv.tables_digest,
+        repr(functype),
+        fingerprint_function(func, set()),
+    ))).hexdigest()
+
+def fingerprint_code(code):
+    return (code.co_code,
+        tuple(fingerprint_code(const) if isinstance(const, types.CodeType)
+            else (type(const).__name__, repr(const)) for const in code.co_consts),
+        code.co_names, code.co_varnames, code.co_argcount, code.co_flags)
+
+# The functions referred through globals are fingerprinted as well, so
+# that a change in a helper function invalidates its callers too. Without
+# 'seen' the fingerprint covers just the identity and code of functions,
+# the dependency graph of the unit takes care of the rest.
+def fingerprint_function(func, seen):
+    if func in seen:
+        return ('function', func.__module__, func.__name__)
+    seen.add(func)
+    return ('function', func.__module__, func.__name__,
+        fingerprint_code(func.func_code),
+        tuple((name, fingerprint_global(func, name, seen))
+            for name in global_names(func.func_code)))
+
+def global_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names.update(global_names(const))
+    return sorted(names)
+
+def fingerprint_global(func, name, seen):
+    if name not in func.func_globals:
+        if hasattr(__builtin__, name):
+            return ('builtin',)
+        return ('missing',)
+    value = func.func_globals[name]
+    if isinstance(value, types.FunctionType):
+        if seen is None:
+            return ('function', id(value), fingerprint_code(value.func_code))
+        return fingerprint_function(value, seen)
+    if isinstance(value, types.ModuleType):
+        return ('module', value.__name__)
+    if isinstance(value, (type, types.ClassType)):
+        return ('class', value.__module__, value.__name__)
+    # Objects that print with their address never hit the cache, but
+    # they don't cause wrong hits either.
+    return (type(value).__name__, repr(value))
+
+# The source of the translator modules, so that improving the
+# translator doesn't leave stale results in the cache.
+def compiler_digest():
+    global _compiler_digest
+    if _compiler_digest is None:
+        digest = hashlib.sha1()
+        for module in [annotator, discovery, spirv, sys.modules[__name__]]:
+            path = module.__file__
+            if path.endswith(('.pyc', '.pyo')):
+                path = path[:-1]
+            with open(path, 'rb') as fd:
+                digest.update(fd.read())
+        _compiler_digest = digest.hexdigest()
+    return _compiler_digest
+_compiler_digest = None
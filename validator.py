@@ -0,0 +1,210 @@
+from collections import defaultdict
+import spirv
+
+# Rejects the malformed modules before they get to a driver. This only
+# checks the structure, in one pass with tables indexed by id:
+#
+#  * every instruction decoded, and has the result and type that
+#    spirv.json says it has, and the right count of operands
+#  * ids are below the bound and defined once, and the bound is within
+#    the universal limit of the specification
+#  * ids are defined before they're used, except where the specification
+#    allows a forward reference: names, decorations, entry points,
+#    branch targets, phi-nodes and function calls. Those are checked at
+#    the end, so they must still be defined somewhere, and branches
+#    must go to labels and calls to functions.
+#  * result types are types
+#  * the sections come in the logical layout order, and the functions
+#    are made of blocks that start with a label and end in a terminator,
+#    except the ones imported by linkage, which may have no blocks
+#
+# Returns the problems found as (index, message) -pairs, empty if the
+# module is fine.
+def validate(instructions, bound):
+    return Validator(bound, len(instructions)).run(instructions)
+
+# The largest bound the specification allows.
+bound_limit = 0x3FFFFF
+
+class Validator(object):
+    def __init__(self, bound, count):
+        self.bound = bound
+        # Each instruction defines one id at most, so a bound past the
+        # count of instructions leaves the ids sparse. They go in a dict
+        # then, rather than in a table as large as the bound.
+        if bound <= count + 1:
+            self.kinds = bytearray(bound) # result id -> what defined it
+        else:
+            self.kinds = defaultdict(int)
+        self.forward = []  # (index, id, kind expected or None)
+        self.undefined = set() # ids already reported as used too early
+        self.imported = set()  # ids decorated with the Import linkage type
+        self.problems = []
+
+    def report(self, index, message):
+        self.problems.append((index, message))
+
+    def run(self, instructions):
+        if self.bound > bound_limit:
+            self.report(0, 'the bound {} is above the limit {}'.format(self.bound, bound_limit))
+        section = 0
+        function = None # None, 'parameters', 'block' or 'between blocks'
+        function_id = 0
+        for index, instruction in enumerate(instructions):
+            if isinstance(instruction, spirv.UnknownInstruction):
+                reason = 'unknown opcode'
+                if instruction.traceback is not None:
+                    reason = instruction.traceback.strip().splitlines()[-1]
+                self.report(index, 'opcode {} did not decode: {}'.format(instruction.opcode, reason))
+                continue
+            name = instruction.name
+            fmt = spirv.opname_table.get(name)
+            if fmt is None:
+                self.report(index, 'unknown instruction {}'.format(name))
+                continue
+            # The layout.
+            if function is None:
+                if name in spirv.section_table:
+                    order = section_order[spirv.section_table[name]]
+                    if order < section:
+                        self.report(index, '{} is out of order, it belongs to the {} section'.format(
+                            name, spirv.section_table[name]))
+                    section = max(section, order)
+                elif name not in anywhere:
+                    self.report(index, '{} appears outside of a function'.format(name))
+                if name == 'OpFunction':
+                    function = 'parameters'
+                    function_id = instruction.result_id
+                elif name == 'OpFunctionEnd':
+                    self.report(index, 'OpFunctionEnd without OpFunction')
+            elif name == 'OpFunction':
+                self.report(index, 'OpFunction inside a function')
+            elif name == 'OpFunctionParameter':
+                if function != 'parameters':
+                    self.report(index, 'OpFunctionParameter after the first block')
+            elif name == 'OpLabel':
+                if function == 'block':
+                    self.report(index, 'the block before this label has no terminator')
+                function = 'block'
+            elif name == 'OpFunctionEnd':
+                if function == 'block':
+                    self.report(index, 'the last block has no terminator')
+                if function == 'parameters' and function_id not in self.imported:
+                    self.report(index, 'function without blocks')
+                function = None
+            elif function != 'block':
+                if name not in anywhere:
+                    self.report(index, '{} is outside of a block'.format(name))
+            elif name in spirv.section_table and name not in in_function:
+                self.report(index, '{} is not allowed in a function'.format(name))
+            elif name in terminators:
+                function = 'between blocks'
+            # The result and type flags.
+            if fmt['result'] != (instruction.result_id != 0):
+                self.report(index, '{} {} a result id'.format(
+                    name, 'should have' if fmt['result'] else 'should not have'))
+            if fmt['type'] != (instruction.type_id != 0):
+                self.report(index, '{} {} a result type'.format(
+                    name, 'should have' if fmt['type'] else 'should not have'))
+            if len(instruction.args) != len(fmt['operands']):
+                self.report(index, '{} has {} operands, expected {}'.format(
+                    name, len(instruction.args), len(fmt['operands'])))
+                continue
+            # The uses, then the definition.
+            if instruction.type_id != 0:
+                self.use(index, instruction.type_id, type_kind, False)
+            forwards = forward_table.get(name, (False,))
+            for n, (operand, arg) in enumerate(zip(fmt['operands'], instruction.args)):
+                forward = forwards[min(n, len(forwards) - 1)]
+                if operand == 'Id' or operand == 'OptionalId' and arg is not None:
+                    self.use_arg(index, arg, forward)
+                elif operand == 'VariableIds':
+                    for item in arg:
+                        self.use_arg(index, item, forward)
+                elif operand == 'VariableLiteralId':
+                    for literal, item in arg:
+                        self.use_arg(index, item, forward)
+            if instruction.result_id != 0:
+                self.define(index, instruction.result_id, kind_of(name))
+            if name == 'OpDecorate' and instruction.args[1] == 'LinkageType':
+                if instruction.args[2][-1:] == [import_linkage]:
+                    self.imported.add(instruction.args[0].result_id)
+            elif name == 'OpGroupDecorate' and instruction.args[0].result_id in self.imported:
+                self.imported.update(target.result_id for target in instruction.args[1])
+        if function is not None:
+            self.report(len(instructions), 'the last function has no OpFunctionEnd')
+        for index, result_id, kind in self.forward:
+            if self.kinds[result_id] == 0:
+                self.report(index, 'id {} is never defined'.format(result_id))
+            elif kind is not None and self.kinds[result_id] != kind:
+                self.report(index, 'id {} should be {}'.format(result_id, kind_names[kind]))
+        return self.problems
+
+    def use_arg(self, index, arg, forward):
+        if not isinstance(arg, spirv.Id):
+            self.report(index, 'expected an id, got {!r}'.format(arg))
+        else:
+            self.use(index, arg.result_id, forward or None, forward)
+
+    # 'forward' is False if the id must be defined already, otherwise
+    # it is the kind the id must turn out to be, or None for any.
+    def use(self, index, result_id, kind, forward):
+        if not 0 < result_id < self.bound:
+            self.report(index, 'id {} is not below the bound {}'.format(result_id, self.bound))
+        elif self.kinds[result_id] == 0:
+            if forward is False:
+                if result_id not in self.undefined:
+                    self.undefined.add(result_id)
+                    self.report(index, 'id {} is used before it is defined'.format(result_id))
+            else:
+                self.forward.append((index, result_id, forward))
+        elif kind is not None and self.kinds[result_id] != kind:
+            self.report(index, 'id {} should be {}'.format(result_id, kind_names[kind]))
+
+    def define(self, index, result_id, kind):
+        if not 0 < result_id < self.bound:
+            self.report(index, 'result id {} is not below the bound {}'.format(result_id, self.bound))
+        elif self.kinds[result_id] != 0:
+            self.report(index, 'id {} is defined twice'.format(result_id))
+        else:
+            self.kinds[result_id] = kind
+
+section_order = dict((section, order)
+    for order, (section, names) in enumerate(spirv.layout_sections))
+
+import_linkage = spirv.const_name_table['LinkageType']['Import']
+
+value_kind, type_kind, label_kind, function_kind = 1, 2, 3, 4
+kind_names = {value_kind:'a value', type_kind:'a type',
+    label_kind:'a label', function_kind:'a function'}
+
+def kind_of(name):
+    if name.startswith('OpType'):
+        return type_kind
+    if name == 'OpLabel':
+        return label_kind
+    if name == 'OpFunction':
+        return function_kind
+    return value_kind
+
+# May appear in any section, and between the blocks.
+anywhere = set(['OpNop', 'OpLine', 'OpUndef'])
+# The instructions of the global sections that can be in functions too.
+in_function = set(['OpVariable', 'OpVariableArray'])
+terminators = set(['OpBranch', 'OpBranchConditional', 'OpSwitch', 'OpReturn',
+    'OpReturnValue', 'OpKill', 'OpUnreachable'])
+
+# The instructions whose ids may be defined later in the module. For
+# each operand, False if it has to be defined already, or the kind it
+# must turn out to be, None for any. The last one goes for the rest.
+forward_table = dict((name, (None,)) for name in ['OpEntryPoint', 'OpExecutionMode',
+    'OpName', 'OpMemberName', 'OpDecorate', 'OpMemberDecorate',
+    'OpGroupDecorate', 'OpGroupMemberDecorate', 'OpPhi'])
+forward_table.update({
+    'OpBranch': (label_kind,),
+    'OpBranchConditional': (False, label_kind),
+    'OpSwitch': (False, label_kind),
+    'OpLoopMerge': (label_kind, False),
+    'OpSelectionMerge': (label_kind, False),
+    'OpFunctionCall': (function_kind, False),
+})
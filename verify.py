@@ -0,0 +1,137 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+import spirv
+
+# Runs the decode -> encode -> decode check of spirv.py over a whole
+# corpus of shaders, one file per task in a process pool. Every file is
+# reported as it finishes, and the summary can be written out as json.
+# When the summary goes to stdout, the reports go to stderr.
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Verify that SPIR-V files survive a decode/encode round-trip.")
+    parser.add_argument('paths', nargs='+',
+        help="files, directories (searched for .spv files) or glob patterns")
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--json', metavar='FILE',
+        help="write the summary as json, '-' for stdout")
+    parser.add_argument('-q', '--quiet', action='store_true',
+        help="only report the files that fail")
+    args = parser.parse_args(argv)
+    output = sys.stderr if args.json == '-' else sys.stdout
+
+    paths = find_files(args.paths)
+    results = []
+    start = time.time()
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        for result in pool.imap_unordered(verify_file, paths, chunksize=4):
+            results.append(result)
+            if result['status'] != 'ok' or not args.quiet:
+                report(result, output)
+    finally:
+        pool.terminate()
+    summary = summarize(results, time.time() - start, args.jobs)
+    sys.stderr.write("{files} files, {ok} ok, {failed} failed in {wall:.2f}s\n".format(**summary))
+    if args.json == '-':
+        json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+    elif args.json:
+        with open(args.json, 'w') as fd:
+            json.dump(summary, fd, indent=2, sort_keys=True)
+    return 0 if summary['failed'] == 0 else 1
+
+def find_files(patterns):
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                dirs.sort()
+                paths.extend(os.path.join(root, name)
+                    for name in sorted(files) if name.endswith('.spv'))
+        elif os.path.exists(pattern):
+            paths.append(pattern)
+        else:
+            paths.extend(sorted(glob.glob(pattern)))
+    seen = set()
+    return [path for path in paths if not (path in seen or seen.add(path))]
+
+def verify_file(path):
+    result = {'path':path, 'status':'ok', 'instructions':0, 'words':0}
+    start = time.time()
+    try:
+        with open(path, 'rb') as fd:
+            instructions, info = spirv.load(fd)
+        words = spirv.encode_spirv(instructions, **info)
+        instructions_, info_ = spirv.decode_spirv(words)
+        result['instructions'] = len(instructions)
+        result['words'] = len(words)
+        mismatch = first_mismatch(instructions, instructions_)
+        if info != info_:
+            result['status'] = 'mismatch'
+            result['mismatch'] = {'index':None, 'expected':repr(info), 'got':repr(info_)}
+        elif mismatch is not None:
+            result['status'] = 'mismatch'
+            result['mismatch'] = mismatch
+    except Exception:
+        result['status'] = 'error'
+        result['error'] = traceback.format_exc()
+    result['time'] = time.time() - start
+    return result
+
+# An instruction that fails to decode counts as a mismatch too,
+# its traceback goes along with the report.
+def first_mismatch(instructions, instructions_):
+    for index, (a, b) in enumerate(zip(instructions, instructions_)):
+        for c in (a, b):
+            if isinstance(c, spirv.UnknownInstruction) and c.traceback:
+                return {'index':index, 'expected':repr(a), 'got':repr(b),
+                    'traceback':c.traceback}
+        if not same_instruction(a, b):
+            return {'index':index, 'expected':repr(a), 'got':repr(b)}
+    if len(instructions) != len(instructions_):
+        index = min(len(instructions), len(instructions_))
+        return {'index':index, 'expected':"{} instructions".format(len(instructions)),
+            'got':"{} instructions".format(len(instructions_))}
+
+def same_instruction(a, b):
+    if isinstance(a, spirv.UnknownInstruction):
+        return (isinstance(b, spirv.UnknownInstruction)
+            and a.opcode == b.opcode and list(a.data) == list(b.data))
+    if isinstance(b, spirv.UnknownInstruction):
+        return False
+    return (a.name == b.name and a.type_id == b.type_id
+        and a.result_id == b.result_id and a.args == b.args)
+
+def report(result, fd):
+    line = "{status:8} {time:7.3f}s {instructions:8} {path}".format(**result)
+    if result['status'] == 'mismatch':
+        mismatch = result['mismatch']
+        line += "\n    at instruction {index}: expected {expected}, got {got}".format(**mismatch)
+    elif result['status'] == 'error':
+        line += "\n    " + result['error'].strip().splitlines()[-1]
+    fd.write(line + '\n')
+    fd.flush()
+
+def summarize(results, wall, jobs):
+    results.sort(key=lambda result: result['path'])
+    failed = [result for result in results if result['status'] != 'ok']
+    cpu = sum(result['time'] for result in results)
+    return {
+        'files':len(results),
+        'ok':len(results) - len(failed),
+        'failed':len(failed),
+        'jobs':jobs,
+        'wall':wall,
+        'cpu':cpu,
+        'words':sum(result['words'] for result in results),
+        'instructions':sum(result['instructions'] for result in results),
+        'results':results,
+    }
+
+if __name__=='__main__':
+    sys.exit(main())